@@ -0,0 +1,79 @@
+'''Measure sustained submissions/s while the overview page is under read load'''
+
+import os
+import time
+import tempfile
+import argparse
+import threading
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Storage Benchmark',
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--urls", type=int, default=200, help="Number of monitored URLs")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per submission")
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent submitting workers")
+    parser.add_argument("--readers", type=int, default=8, help="Concurrent overview readers")
+    parser.add_argument("--duration", type=float, default=20, help="Run time in seconds")
+    args = parser.parse_args()
+
+    # fresh database, must be set before the server module is imported #
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(tmp_dir, "benchmark.db")
+    os.environ.setdefault("QUEUE_HOST", "localhost")
+
+    import server
+
+    with server.app.app_context():
+        server.create_app()
+        for i in range(args.urls):
+            server.db.session.add(server.URL(uuid=str(i), base_url="https://example-{}.com".format(i),
+                                             owner="benchmark", token="token"))
+        server.db.session.commit()
+
+    counters = { "submissions" : 0, "reads" : 0, "errors" : 0 }
+    lock = threading.Lock()
+    stop = time.time() + args.duration
+
+    def count(key):
+        with lock:
+            counters[key] += 1
+
+    def submit(offset):
+
+        client = server.app.test_client()
+        i = offset
+        while time.time() < stop:
+
+            url = "https://example-{}.com".format(i % args.urls)
+            pages = [ ("{}/page-{}".format(url, p),
+                       { "base_status" : True,
+                         "links" : { "failed" : 0, "results" : [ { url : True } ] } })
+                            for p in range(args.pages) ]
+
+            r = client.post("/submit-check", json={ "url" : url, "token" : "token", "check" : pages })
+            count("submissions" if r.status_code == 200 else "errors")
+            i += args.writers
+
+    def read():
+
+        client = server.app.test_client()
+        while time.time() < stop:
+            r = client.get("/", headers={ "X-Forwarded-Preferred-Username" : "benchmark" })
+            count("reads" if r.status_code == 200 else "errors")
+
+    threads = [ threading.Thread(target=submit, args=(i,)) for i in range(args.writers) ]
+    threads += [ threading.Thread(target=read) for i in range(args.readers) ]
+
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    print("Database:    {}".format(os.environ["DATABASE_URI"]))
+    print("Submissions: {:.1f}/s ({} pages each)".format(counters["submissions"]/elapsed, args.pages))
+    print("Overview:    {:.1f}/s".format(counters["reads"]/elapsed))
+    print("Errors:      {}".format(counters["errors"]))
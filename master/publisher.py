@@ -0,0 +1,127 @@
+import sys
+import time
+import queue
+import threading
+import concurrent.futures
+import pika
+
+class BufferFull(Exception):
+    '''Raised if a message cannot be buffered while the queue server is unavailable'''
+    pass
+
+def queue_for_group(base_name, group, dedicated_groups):
+    '''Queue of an URL group (URL.master_host): "<base>.<group>" for groups with a
+       dedicated queue, the base queue for all other groups'''
+
+    group = (group or "").strip()
+    if group not in dedicated_groups:
+        return base_name
+
+    return "{}.{}".format(base_name, group)
+
+class Publisher:
+    '''Long lived AMQP publisher shared across requests.
+
+       Pika connections are not thread safe, so a single background thread owns the
+       connection and channel, publishes with confirms and reconnects on failure.
+       Requests hand messages over through a bounded buffer and get a future back,
+       which resolves once the broker confirmed the message.'''
+
+    def __init__(self, host, buffer_size=10000, heartbeat=60, max_backoff=60):
+
+        self.host = host
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.connection = None
+        self.channel = None
+        self.declared = set()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def publish(self, body, queue_name="scheduled"):
+        '''Queue a message for publishing, returns a future for the broker confirm'''
+
+        future = concurrent.futures.Future()
+        try:
+            self.buffer.put_nowait((queue_name, body, future))
+        except queue.Full:
+            raise BufferFull("Publish buffer full ({} messages)".format(self.buffer.maxsize))
+
+        return future
+
+    def _connect(self):
+
+        self._close()
+
+        parameters = pika.ConnectionParameters(self.host, heartbeat=self.heartbeat)
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        self.declared = set()
+
+        print("Publisher connected to {}".format(self.host), file=sys.stderr)
+
+    def _close(self):
+
+        if self.connection and self.connection.is_open:
+            try:
+                self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+        self.connection = None
+        self.channel = None
+
+    def _publish(self, queue_name, body):
+
+        if queue_name not in self.declared:
+            self.channel.queue_declare(queue=queue_name)
+            self.declared.add(queue_name)
+
+        # blocks until the broker confirmed, raises on nack or unroutable #
+        self.channel.basic_publish(exchange="", routing_key=queue_name, body=body, mandatory=True)
+
+    def _run(self):
+
+        pending = None
+        backoff = 1
+
+        while True:
+
+            try:
+
+                if not self.connection or self.connection.is_closed:
+                    self._connect()
+                    backoff = 1
+
+                # wait for messages, servicing heartbeats in between #
+                if not pending:
+                    try:
+                        pending = self.buffer.get(timeout=1)
+                    except queue.Empty:
+                        self.connection.process_data_events(time_limit=0)
+                        continue
+
+                queue_name, body, future = pending
+                self._publish(queue_name, body)
+                future.set_result(True)
+                pending = None
+
+            except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+
+                # rejected by the broker, retrying will not help #
+                pending[2].set_exception(e)
+                pending = None
+
+            except pika.exceptions.AMQPError as e:
+
+                # keep the pending message and retry after reconnect #
+                print("Publisher error: {}, retrying in {}s".format(repr(e), backoff), file=sys.stderr)
+                self._close()
+                time.sleep(backoff)
+                backoff = min(backoff*2, self.max_backoff)
@@ -8,27 +8,44 @@ import string
 import sys
 import json
 import datetime
-import pika
 import secrets
 import uuid
 import time
+import threading
+import zlib
+import concurrent.futures
 from flask_wtf import CSRFProtect
 
+import publisher
+import storage
+
 import sqlalchemy
-from sqlalchemy import Column, Integer, String, Boolean, or_, and_, asc, desc, not_, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, or_, and_, asc, desc, not_, ForeignKey
+from sqlalchemy import Index, LargeBinary, func, select, exists
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, BooleanField, DecimalField, HiddenField, SelectField
-from wtforms.validators import DataRequired, Length, URL
+from wtforms import IntegerField
+from wtforms.validators import DataRequired, Length, URL, Optional, NumberRange
 
 app = flask.Flask("Atlantis Web-Checker")
 
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///sqlite.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = storage.database_uri()
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = storage.engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 db = SQLAlchemy(app)
 
+ROLLUP_PERIODS = { "hour" : 3600, "day" : 86400 }
+
+# shared AMQP publisher, started in create_app #
+queue_publisher = None
+
+# read only session & single writer for the database, set up in create_app #
+reads = None
+db_writer = None
+
 class EntryForm(FlaskForm):
 
     url = StringField("URL", validators=[URL()])
@@ -41,6 +58,12 @@ class EntryForm(FlaskForm):
 
     master_host = StringField("Group")
 
+    check_interval = IntegerField("Check Interval (minutes)",
+                                    validators=[Optional(), NumberRange(min=1)])
+    extended_interval = IntegerField("Extended Check Interval (hours)",
+                                    validators=[Optional(), NumberRange(min=1)])
+    adaptive = BooleanField("Adaptive Check Interval")
+
 class DictionaryWord(db.Model):
 
     __tablename__ = "words"
@@ -72,8 +95,28 @@ class URL(db.Model):
     # disabled #
     disabled = Column(Boolean)
 
+    # seconds between basic/extended checks, None for the configured default #
+    check_interval = Column(Integer)
+    extended_interval = Column(Integer)
+
+    # derive the check interval from the stability of the URL instead #
+    adaptive = Column(Boolean)
+
+    # last change of the entry, for incremental scheduler syncs #
+    modified = Column(Float)
+
+    # scheduler partition, see _partition #
+    partition = Column(Integer, index=True)
+
     results = relationship("CheckResult", uselist=True)
 
+    # denormalized last result, loaded in the same query as the URL #
+    latest = relationship("LatestResult", uselist=False, lazy="joined",
+                            cascade="all, delete-orphan")
+
+    # aggregated history of results past the retention period #
+    rollups = relationship("ResultRollup", uselist=True, cascade="all, delete-orphan")
+
     def __eq__(self, other):
         if isinstance(other, str):
             return self.uuid == other
@@ -89,7 +132,7 @@ class URL(db.Model):
     def last_human_date(self):
         '''Get the last timestamp for an URL'''
 
-        last = self.last_result()
+        last = self.latest
         if last:
             dt = datetime.datetime.fromtimestamp(last.timestamp)
             return dt.strftime("%d. %B %Y at %H:%M")
@@ -98,7 +141,7 @@ class URL(db.Model):
 
     def last_status(self):
 
-        last = self.last_result()
+        last = self.latest
         if last:
             if last.base_check == True:
                 if last.check_failed_message:
@@ -121,12 +164,48 @@ class URL(db.Model):
             "recursive" : self.recursive,
             "master_host" : self.master_host,
             "disabled" : self.disabled,
+            "check_interval" : self.effective_check_interval(),
+            "extended_interval" : self.effective_extended_interval(),
         }
 
+    def effective_check_interval(self):
+
+        if self.adaptive:
+            return self.adaptive_interval()
+
+        return self.check_interval or app.config["CHECK_INTERVAL"]
+
+    def adaptive_interval(self):
+        '''Minimum interval while an URL is failing or just changed its status, then
+           doubled each time the time without status change grows by the same
+           factor, clamped to the maximum interval'''
+
+        min_interval = app.config["ADAPTIVE_MIN_INTERVAL"]
+        max_interval = app.config["ADAPTIVE_MAX_INTERVAL"]
+
+        latest = self.latest
+        if not latest or latest.status_changed is None or self.last_status() != "OK":
+            return min_interval
+
+        stable = (time.time() - latest.status_changed) * app.config["ADAPTIVE_FACTOR"]
+
+        interval = min_interval
+        while interval < max_interval and min(interval * 2, max_interval) <= stable:
+            interval = min(interval * 2, max_interval)
+
+        return interval
+
+    def effective_extended_interval(self):
+        return self.extended_interval or app.config["EXTENDED_CHECK_INTERVAL"]
+
 
 class CheckResult(db.Model):
 
     __tablename__ = "results"
+    __table_args__ = (Index("ix_results_parent_timestamp", "parent", "timestamp"),
+                      Index("ix_results_timestamp", "timestamp"),
+                      Index("ix_results_history", "parent", "timestamp", "base_check",
+                            "lighthouse_score", "links_failed_count", "spelling_failed_count"))
 
     uuid = Column(String, primary_key=True)
     parent = Column(String, ForeignKey("url.uuid"))
@@ -136,169 +215,661 @@ class CheckResult(db.Model):
     timestamp = Column(Integer)
 
     lighthouse_score = Column(Integer)
-    lighthouse_results = Column(String)
+    lighthouse_results = Column(String) # legacy, replaced by lighthouse_results_hash
+    lighthouse_results_hash = Column(String, ForeignKey("blobs.hash"), index=True)
 
-    links_results = Column(String)
+    links_results = Column(String) # legacy, replaced by links_results_hash
+    links_results_hash = Column(String, ForeignKey("blobs.hash"), index=True)
     links_failed_count = Column(Integer)
 
-    spelling = Column(String)
+    spelling = Column(String) # legacy, replaced by spelling_hash
+    spelling_hash = Column(String, ForeignKey("blobs.hash"), index=True)
     spelling_failed_count = Column(Integer)
 
     check_failed_message = Column(String)
 
+    # blobs are only loaded (and decompressed) when accessed #
+    lighthouse_results_blob = relationship("Blob", foreign_keys=[lighthouse_results_hash])
+    links_results_blob = relationship("Blob", foreign_keys=[links_results_hash])
+    spelling_blob = relationship("Blob", foreign_keys=[spelling_hash])
+
+    def get_lighthouse_results(self):
+        if self.lighthouse_results_blob:
+            return self.lighthouse_results_blob.text()
+        return self.lighthouse_results
+
+    def get_links_results(self):
+        if self.links_results_blob:
+            return self.links_results_blob.text()
+        return self.links_results
+
+    def get_spelling(self):
+        if self.spelling_blob:
+            return self.spelling_blob.text()
+        return self.spelling
+
+class Blob(db.Model):
+    '''Compressed check payload, stored once and referenced by its content hash'''
+
+    __tablename__ = "blobs"
+
+    hash = Column(String, primary_key=True)
+    data = Column(LargeBinary)
+    size = Column(Integer)
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @staticmethod
+    def from_text(text):
+        encoded = text.encode()
+        return Blob(hash=hashlib.sha256(encoded).hexdigest(), data=zlib.compress(encoded),
+                    size=len(encoded))
+
+    def text(self):
+        return zlib.decompress(self.data).decode()
+
+class LatestResult(db.Model):
+    '''Copy of the most recent CheckResult of an URL, kept up to date on submission'''
+
+    __tablename__ = "latest_results"
+
+    parent = Column(String, ForeignKey("url.uuid"), primary_key=True)
+    result = Column(String)
+
+    base_check = Column(Boolean)
+    timestamp = Column(Integer)
+
+    lighthouse_score = Column(Integer)
+    links_failed_count = Column(Integer)
+    spelling_failed_count = Column(Integer)
+
+    check_failed_message = Column(String)
+
+    # time of the first result with the current status #
+    status_changed = Column(Float)
+
+class ResultRollup(db.Model):
+    '''Aggregate of all results of an URL in one hour or day, replaces expired results'''
+
+    __tablename__ = "result_rollups"
+
+    parent = Column(String, ForeignKey("url.uuid"), primary_key=True)
+    period = Column(String, primary_key=True)
+    start = Column(Integer, primary_key=True)
+
+    checks = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+
+    lighthouse_min = Column(Float)
+    lighthouse_sum = Column(Float, default=0)
+    lighthouse_count = Column(Integer, default=0)
+
+    links_failed_count = Column(Integer, default=0)
+    spelling_failed_count = Column(Integer, default=0)
+
+    def uptime(self):
+        if not self.checks:
+            return None
+        return (self.checks - self.failures) / self.checks
+
+    def lighthouse_avg(self):
+        if not self.lighthouse_count:
+            return None
+        return self.lighthouse_sum / self.lighthouse_count
+
+    def fold(self, result):
+        '''Add a single CheckResult row to this roll-up'''
+
+        self.checks = (self.checks or 0) + 1
+        self.failures = (self.failures or 0) + int(not result.base_check)
+
+        if result.lighthouse_score is not None:
+            self.lighthouse_sum = (self.lighthouse_sum or 0) + result.lighthouse_score
+            self.lighthouse_count = (self.lighthouse_count or 0) + 1
+            if self.lighthouse_min is None or result.lighthouse_score < self.lighthouse_min:
+                self.lighthouse_min = result.lighthouse_score
+
+        self.links_failed_count = (self.links_failed_count or 0) + (result.links_failed_count or 0)
+        self.spelling_failed_count = ((self.spelling_failed_count or 0)
+                                        + (result.spelling_failed_count or 0))
+
+class Notification(db.Model):
+    '''Outbox of pending dispatch messages, written in the same transaction as results'''
+
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(String)
+    message = Column(String)
+
+    created = Column(Integer)
+    attempts = Column(Integer, default=0)
+    next_attempt = Column(Integer, index=True)
+    last_error = Column(String)
+
+class SchedulerLease(db.Model):
+    '''Ownership of a partition of the URLs by one of several schedulers'''
+
+    __tablename__ = "scheduler_leases"
+
+    partition = Column(Integer, primary_key=True)
+    holder = Column(String)
+    expires = Column(Float)
+
+class SchedulerMember(db.Model):
+    '''A live scheduler, including those which currently hold no partition'''
+
+    __tablename__ = "scheduler_members"
+
+    holder = Column(String, primary_key=True)
+    expires = Column(Float)
+
+def _send_dispatch(owner, message):
+    '''Send a message to an owner via the dispatch server'''
+
+    payload = { "users": [owner], "msg" : message }
+
+    if app.config.get("DISPATCH_SERVER"):
+        r = requests.post(app.config["DISPATCH_SERVER"] + "/smart-send", json=payload,
+                          auth=app.config["DISPATCH_AUTH"], timeout=app.config["DISPATCH_TIMEOUT"])
+        r.raise_for_status()
+    else:
+        # dummy message if dispatch would have fired #
+        print("Dispatch would have fired (not configured) \n{}".format(json.dumps(payload, indent=2)))
+
+def _finish_notifications(sent_ids, failed_ids, error):
+    '''Remove sent notifications from the outbox and reschedule failed ones'''
+
+    now = int(datetime.datetime.now().timestamp())
+
+    if sent_ids:
+        db.session.query(Notification).filter(Notification.id.in_(sent_ids)).delete(
+                        synchronize_session=False)
+
+    for notification in db.session.query(Notification).filter(Notification.id.in_(failed_ids)):
+
+        notification.attempts = (notification.attempts or 0) + 1
+        notification.last_error = error
+
+        # exponential backoff, give up eventually #
+        if notification.attempts >= app.config["NOTIFICATION_MAX_ATTEMPTS"]:
+            print("Dropping notification for {}".format(notification.owner), file=sys.stderr)
+            db.session.delete(notification)
+        else:
+            backoff = min(app.config["NOTIFICATION_BACKOFF"] * 2**(notification.attempts - 1),
+                          app.config["NOTIFICATION_MAX_BACKOFF"])
+            notification.next_attempt = now + int(backoff)
+
+    db.session.commit()
+
+def send_notifications(batch_size=1000):
+    '''Send the notifications of owners with a due notification from the outbox,
+       merging all pending messages of an owner into one in the order they were
+       created, returns the number of sent notifications'''
+
+    now = int(datetime.datetime.now().timestamp())
+    owners = [ owner for (owner,) in reads.query(Notification.owner).filter(
+                    Notification.next_attempt <= now).distinct().limit(batch_size) ]
+
+    # all pending messages of an owner go out in order, so a newer message never
+    # overtakes an older one waiting in backoff #
+    due = []
+    for i in range(0, len(owners), 500):
+        due += reads.query(Notification).filter(Notification.owner.in_(owners[i:i+500])).order_by(
+                    Notification.id).all()
+    reads.remove()
+
+    by_owner = dict()
+    for notification in due:
+        by_owner.setdefault(notification.owner, []).append(notification)
+
+    # no database writes while waiting for the dispatch server #
+    sent = 0
+    for owner, notifications in by_owner.items():
+
+        ids = [ n.id for n in notifications ]
+        try:
+            _send_dispatch(owner, "\n\n".join([ n.message for n in notifications ]))
+            db_writer.run(_finish_notifications, ids, [], None)
+            sent += len(notifications)
+        except requests.exceptions.RequestException as e:
+            print("Dispatch to {} failed: {}".format(owner, e), file=sys.stderr)
+            db_writer.run(_finish_notifications, [], ids, str(e))
+
+    return sent
+
+def _notification_loop(interval):
+    '''Drain the outbox, notifications arriving within one interval are coalesced'''
+
+    while True:
+
+        with app.app_context():
+            try:
+                send_notifications()
+            except sqlalchemy.exc.OperationalError as e:
+                print("Sending notifications failed: {}".format(e), file=sys.stderr)
+
+        time.sleep(interval)
+
+def compact_results(retention_days, batch_size):
+    '''Fold the oldest batch of results past retention into roll-ups and delete them,
+       returns the number of compacted results'''
+
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).timestamp()
+
+    # only scalar columns, the json blobs are never loaded #
+    batch = db.session.query(CheckResult.uuid, CheckResult.parent, CheckResult.timestamp,
+                             CheckResult.base_check, CheckResult.lighthouse_score,
+                             CheckResult.links_failed_count, CheckResult.spelling_failed_count
+                        ).filter(CheckResult.timestamp < cutoff).order_by(
+                             CheckResult.timestamp).limit(batch_size).all()
+
+    if not batch:
+        return 0
+
+    rollups = dict()
+    for result in batch:
+
+        # orphaned results of deleted URLs are just dropped #
+        if not result.parent:
+            continue
+
+        for period, seconds in ROLLUP_PERIODS.items():
+
+            key = (result.parent, period, int(result.timestamp) // seconds * seconds)
+            if key not in rollups:
+                rollups[key] = (db.session.get(ResultRollup, key)
+                                    or ResultRollup(parent=key[0], period=key[1], start=key[2]))
+
+            rollups[key].fold(result)
+
+    db.session.add_all(rollups.values())
+    db.session.query(CheckResult).filter(CheckResult.uuid.in_([ r.uuid for r in batch ])).delete(
+                        synchronize_session=False)
+    db.session.commit()
+
+    return len(batch)
+
+def collect_blobs(batch_size):
+    '''Delete a batch of payloads no longer referenced by any result, returns the
+       number of deleted payloads'''
+
+    orphans = db.session.query(Blob.hash).filter(
+                    ~exists().where(CheckResult.lighthouse_results_hash==Blob.hash),
+                    ~exists().where(CheckResult.links_results_hash==Blob.hash),
+                    ~exists().where(CheckResult.spelling_hash==Blob.hash)).limit(batch_size).all()
+
+    if not orphans:
+        return 0
+
+    db.session.query(Blob).filter(Blob.hash.in_([ h for (h,) in orphans ])).delete(
+                        synchronize_session=False)
+    db.session.commit()
+
+    return len(orphans)
+
+def _compaction_loop(retention_days, batch_size, interval):
+    '''Compact expired results in small transactions to not block the database'''
+
+    while True:
+
+        # every batch is a separate job, submissions get in between #
+        try:
+            while db_writer.run(compact_results, retention_days, batch_size) == batch_size:
+                time.sleep(0.1)
+            while db_writer.run(collect_blobs, batch_size) == batch_size:
+                time.sleep(0.1)
+        except sqlalchemy.exc.OperationalError as e:
+            print("Compaction failed: {}".format(e), file=sys.stderr)
+
+        time.sleep(interval)
+
+def _update_latest(url_obj, check_results):
+    '''Summarize the CheckResults of one submission (one per checked page) as the
+       denormalized latest result of an URL (caller commits)'''
+
+    last_status = url_obj.last_status() if url_obj.latest else None
+    latest = url_obj.latest or LatestResult(parent=url_obj.uuid)
+    lighthouse_scores = [ r.lighthouse_score for r in check_results if r.lighthouse_score is not None ]
+
+    latest.result = check_results[0].uuid
+    latest.base_check = all(r.base_check for r in check_results)
+    latest.timestamp = max(r.timestamp for r in check_results)
+    latest.lighthouse_score = min(lighthouse_scores) if lighthouse_scores else None
+    latest.links_failed_count = sum(r.links_failed_count or 0 for r in check_results)
+    latest.spelling_failed_count = sum(r.spelling_failed_count or 0 for r in check_results)
+    latest.check_failed_message = "".join(r.check_failed_message or "" for r in check_results)
+
+    url_obj.latest = latest
+    if url_obj.last_status() != last_status:
+        latest.status_changed = latest.timestamp
+
+def _status_changed(url_uuid, base_check):
+    '''Time of the first result since the base check last changed to its current
+       value, from the results history'''
+
+    last_other = db.session.query(func.max(CheckResult.timestamp)).filter(
+                        CheckResult.parent==url_uuid, CheckResult.base_check!=base_check).scalar()
+
+    query = db.session.query(func.min(CheckResult.timestamp)).filter(CheckResult.parent==url_uuid)
+    if last_other is not None:
+        query = query.filter(CheckResult.timestamp > last_other)
+
+    return query.scalar()
+
+def _last_check_timestamp(extended_after=None):
+    '''Correlated subquery for the newest result timestamp of an URL, optionally
+       only counting results with extended checks newer than extended_after'''
+
+    query = select(func.max(CheckResult.timestamp)).where(CheckResult.parent==URL.uuid)
+    if extended_after is not None:
+        query = query.where(and_(CheckResult.timestamp > extended_after,
+                                 or_(CheckResult.spelling_hash.isnot(None),
+                                     CheckResult.links_results_hash.isnot(None),
+                                     CheckResult.lighthouse_score.isnot(None),
+                                     CheckResult.spelling.isnot(None),
+                                     CheckResult.links_results.isnot(None))))
+
+    return query.correlate(URL).scalar_subquery()
+
+def _interval(column, default):
+    return func.coalesce(column, default)
+
 @app.route("/get-check-info")
 def get_check_info():
     '''Get info about checks for scheduler'''
 
-    # get all URLs with no checks so far #
-    no_check_results = db.session.query(URL).outerjoin(
-                CheckResult, URL.uuid==CheckResult.parent).filter(CheckResult.uuid==None).all()
+    now = time.time()
+    check_interval = _interval(URL.check_interval, app.config["CHECK_INTERVAL"])
+    extended_interval = _interval(URL.extended_interval, app.config["EXTENDED_CHECK_INTERVAL"])
 
-    # get all URLs with outdated checks #
-    run_before_base = datetime.datetime.now() - datetime.timedelta(minutes=5)
-    outdated_joined = db.session.query(URL).join(CheckResult, URL.uuid == CheckResult.parent)
-    outdated_results = outdated_joined.filter(
-            and_(CheckResult.timestamp < run_before_base.timestamp(),
-                 CheckResult.timestamp != None)).all()
+    # both subqueries resolve via the (parent, timestamp) index, once per URL #
+    last_check = _last_check_timestamp()
+    last_extended = _last_check_timestamp(extended_after=now - extended_interval)
 
-    # updated outdated checks with extended #
-    run_before_extended = datetime.datetime.now() - datetime.timedelta(hours=5)
-    not_outdated_extended = db.session.query(URL).join(CheckResult, URL.uuid == CheckResult.parent).filter(
-            and_(CheckResult.timestamp > run_before_extended.timestamp(), CheckResult.timestamp != None),
-                 or_(CheckResult.spelling.isnot(None),
-                     CheckResult.links_results.isnot(None),
-                     CheckResult.lighthouse_score.isnot(None))
-            ).all()
+    # get all URLs with no checks so far or outdated checks, adaptive intervals are
+    # derived from the latest result and compared below #
+    due = reads.query(URL, last_check, last_extended).filter(
+                or_(URL.adaptive == True, last_check.is_(None),
+                    last_check < now - check_interval)).all()
 
-    for url_obj in not_outdated_extended:
+    combined_list = []
+    for url_obj, last_check_timestamp, last_extended_timestamp in due:
 
-        print(url_obj.base_url, "removing advanced checks", file=sys.stderr)
-
-        try:
-            # find in list by uuid
-            target_obj_index = outdated_results.index(url_obj.uuid)
-        except ValueError:
+        if (url_obj.adaptive and last_check_timestamp is not None
+                and last_check_timestamp >= now - url_obj.effective_check_interval()):
             continue
 
-        # set exteneded check to false in the outdated list #
-        outdated_results[target_obj_index].check_links = False
-        outdated_results[target_obj_index].check_lighthouse = False
-        outdated_results[target_obj_index].check_spelling = False
+        url_dict = url_obj.serialize()
+
+        # skip extended checks if they ran recently #
+        if last_extended_timestamp is not None:
+            print(url_obj.base_url, "removing advanced checks", file=sys.stderr)
+            url_dict.update({ "check_links" : False,
+                              "check_lighthouse" : False,
+                              "check_spelling" : False })
+
+        combined_list.append(url_dict)
 
-    # combine & return results #
-    combined_list = [ r.serialize() for r in no_check_results + outdated_results]
     return flask.jsonify(combined_list)
 
+def _partition(url_uuid):
+    '''Scheduler partition of an URL, stable across processes'''
+    return zlib.crc32(url_uuid.encode()) % app.config["SCHEDULER_PARTITIONS"]
+
+def _assign_partitions():
+    '''Store the partition of URLs added before it was tracked or of all URLs if
+       env:SCHEDULER_PARTITIONS changed, returns the number of updated URLs'''
+
+    updates = [ { "uuid" : url_uuid, "partition" : _partition(url_uuid) }
+                    for url_uuid, partition in db.session.query(URL.uuid, URL.partition)
+                        if partition != _partition(url_uuid) ]
+
+    db.session.bulk_update_mappings(URL, updates)
+    db.session.commit()
+
+    return len(updates)
+
+@app.route("/get-check-schedule")
+def get_check_schedule():
+    '''URLs with their intervals and last check times for the scheduler, only those
+       modified at or after ?since=<timestamp> and in ?partitions=<p1,p2,..> if given.
+       The returned timestamp is the since for the next incremental sync.'''
+
+    now = time.time()
+    since = flask.request.args.get("since", type=float)
+    partitions = flask.request.args.get("partitions")
+    if partitions is not None:
+        partitions = { int(p) for p in partitions.split(",") if p }
+
+    extended_interval = _interval(URL.extended_interval, app.config["EXTENDED_CHECK_INTERVAL"])
+    last_check = _last_check_timestamp()
+    last_extended = _last_check_timestamp(extended_after=now - extended_interval)
+
+    query = reads.query(URL, last_check, last_extended)
+    if since is not None:
+        query = query.filter(URL.modified >= since)
+    if partitions is not None:
+        query = query.filter(URL.partition.in_(partitions))
+
+    urls = []
+    for url_obj, last_check_timestamp, last_extended_timestamp in query.all():
+
+        url_dict = url_obj.serialize()
+        url_dict.update({ "last_check" : last_check_timestamp,
+                          "last_extended" : last_extended_timestamp })
+        urls.append(url_dict)
+
+    return flask.jsonify({ "timestamp" : now, "full" : since is None, "urls" : urls })
+
+def _renew_leases(holder, ttl):
+    '''Renew the partitions of a scheduler and adjust them to a fair share of the
+       live schedulers. Partitions above the share are released, so they can be
+       claimed by schedulers which joined in the meantime, expired partitions are
+       claimed up to the share. Returns the partitions held.'''
+
+    now = time.time()
+    count = app.config["SCHEDULER_PARTITIONS"]
+
+    leases = { lease.partition : lease for lease in db.session.query(SchedulerLease) }
+    for partition in range(count):
+        if partition not in leases:
+            leases[partition] = SchedulerLease(partition=partition, expires=0)
+            db.session.add(leases[partition])
+
+    db.session.merge(SchedulerMember(holder=holder, expires=now + ttl))
+    db.session.query(SchedulerMember).filter(SchedulerMember.expires <= now).delete()
+    members = { m.holder for m in db.session.query(SchedulerMember) } | { holder }
+
+    # the partition count was reduced #
+    for partition in [ p for p in leases if p >= count ]:
+        db.session.delete(leases.pop(partition))
+
+    live = { p : lease.holder for p, lease in leases.items() if lease.holder and lease.expires > now }
+    share = -(-count // len(members))
+
+    held = sorted(p for p, h in live.items() if h == holder)
+    for partition in held[share:]:
+        leases[partition].holder = None
+        leases[partition].expires = 0
+    held = held[:share]
+
+    for partition in sorted(leases):
+        if len(held) >= share:
+            break
+        if partition not in live:
+            held.append(partition)
+
+    for partition in held:
+        leases[partition].holder = holder
+        leases[partition].expires = now + ttl
+
+    db.session.commit()
+    return sorted(held)
+
+@app.route("/scheduler-lease", methods=["POST"])
+def scheduler_lease():
+    '''Acquire or renew the partitions of a scheduler for ttl seconds'''
+
+    holder = flask.request.json.get("holder")
+    ttl = float(flask.request.json.get("ttl") or 60)
+    if not holder:
+        return ("Missing holder", 400)
+
+    partitions = db_writer.run(_renew_leases, holder, ttl)
+    return flask.jsonify({ "partitions" : partitions, "count" : app.config["SCHEDULER_PARTITIONS"] })
+
+def _blob_ref(text, blobs):
+    '''Get the hash for a payload, collecting it in blobs for a later insert'''
+
+    blob_hash = Blob.content_hash(text)
+    if blob_hash not in blobs:
+        blobs.update({ blob_hash : text })
+
+    return blob_hash
+
+def _save_blobs(blobs):
+    '''Add collected payloads which are not stored yet to the session'''
+
+    hashes = list(blobs)
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i+500]
+        existing = { h for (h,) in db.session.query(Blob.hash).filter(Blob.hash.in_(chunk)) }
+        db.session.add_all([ Blob.from_text(blobs[h]) for h in chunk if h not in existing ])
+
+def _build_check_result(url_obj, url, results, timestamp, blobs):
+    '''Create a CheckResult for one checked page of a submission, payloads are
+       collected in blobs'''
+
+    check_failed_message = ""
+
+    # base information #
+    check_result_obj = CheckResult()
+    check_result_obj.uuid = str(uuid.uuid4())
+    check_result_obj.url = url
+    check_result_obj.parent = url_obj.uuid
+    check_result_obj.timestamp = timestamp
+
+    # base check #
+    check_result_obj.base_check = bool(results["base_status"])
+    if not check_result_obj.base_check:
+        check_failed_message += "ERROR: URL unreachable:\n{}\n".format(check_result_obj.url)
+
+    if "spelling" in results:
+        check_result_obj.spelling_hash = _blob_ref(json.dumps(results.get("spelling")), blobs)
+        check_result_obj.spelling_failed_count = len(results.get("spelling"))
+
+    if "lighthouse" in results:
+        if results.get("lighthouse").get("audits"):
+            check_result_obj.lighthouse_results_hash = _blob_ref(
+                                results.get("lighthouse").get("audits"), blobs)
+        check_result_obj.lighthouse_score = results.get("lighthouse").get("score").get("performance")
+
+        # lighthouse problem #
+        if check_result_obj.lighthouse_score < 0.75:
+            check_failed_message += "Warning: Lighthouse score degraded\n{}\n".format(
+                check_result_obj.url)
+
+    if "links" in results:
+        check_result_obj.links_failed_count = results["links"]["failed"]
+        check_result_obj.links_results_hash = _blob_ref(json.dumps(results["links"]["results"]), blobs)
+
+        # dead links problem #
+        if check_result_obj.links_failed_count > 0:
+            check_failed_message += "Warning: Dead Links on Website ->\n"
+            failed_links = [ list(el.keys())[0] for el in results["links"]["results"]
+                                     if not list(el.values())[0] ]
+            check_failed_message += "\n".join(failed_links)
+
+    # overall fail ? #
+    # check = False (fail) if message is non-empty #
+    check_result_obj.base_check = not bool(check_failed_message)
+    check_result_obj.check_failed_message = check_failed_message
+
+    return check_result_obj
+
+def _ingest_submission(url_uuid, checks):
+    '''Store all checked pages of a submission (runs in the writer)'''
+
+    url_obj = db.session.get(URL, url_uuid)
+
+    # previous status is the denormalized latest result, loaded with the URL #
+    last_status = url_obj.latest.base_check if url_obj.latest else None
+
+    timestamp = datetime.datetime.now().timestamp()
+    blobs = dict()
+    check_results = [ _build_check_result(url_obj, url, results, timestamp, blobs)
+                            for url, results in checks ]
+
+    # previous status is replaced now #
+    _update_latest(url_obj, check_results)
+    latest = url_obj.latest
+
+    # notify if check failed + either no last result or last was success, or if recovered #
+    if((last_status is None and not latest.base_check)
+            or (last_status is not None and last_status != latest.base_check)):
+
+        if latest.base_check:
+            message = "{} recovered".format(url_obj.base_url)
+        else:
+            message = "{}\n{}".format(url_obj.base_url, latest.check_failed_message)
+
+        db.session.add(Notification(owner=url_obj.owner, message=message,
+                                    created=int(timestamp), next_attempt=int(timestamp)))
+
+    # let the scheduler pick up the new interval with its next sync #
+    if url_obj.adaptive and latest.status_changed == latest.timestamp:
+        url_obj.modified = timestamp
+
+    # insert all pages, payloads, the latest result and notifications in one transaction #
+    _save_blobs(blobs)
+    db.session.flush()
+    db.session.bulk_save_objects(check_results)
+    db.session.commit()
+
 @app.route("/submit-check", methods=["POST"])
 def submit_check():
     '''Receive a json dict of url : check_results from a worker'''
 
     jdict = flask.request.json
-    url_obj = db.session.query(URL).filter(URL.base_url==jdict["url"]).first()
+    url_obj = reads.query(URL).filter(URL.base_url==jdict["url"]).first()
 
-    print(json.dumps(jdict, indent=2))
+    if not url_obj:
+        return ("URL {} does not exist".format(jdict["url"]), 404)
 
     if not "token" in jdict or url_obj.token != jdict.get("token"):
         return ("Missing or wrong token in submission", 401)
 
-    for url, results in jdict["check"]:
-
-        check_failed_message = ""
-
-        # base information #
-        check_result_obj = CheckResult()
-        check_result_obj.uuid = str(uuid.uuid4())
-        check_result_obj.url = url
-        check_result_obj.parent = url_obj.uuid
-        check_result_obj.timestamp = datetime.datetime.now().timestamp()
-
-        # base check #
-        check_result_obj.base_check = bool(results["base_status"])
-        if not check_result_obj.base_check:
-            check_failed_message += "ERROR: URL unreachable:\n{}\n".format(check_result_obj.url)
-
-        if "spelling" in results:
-            check_result_obj.spelling = json.dumps(results.get("spelling"))
-            check_result_obj.spelling_failed_count = len(results.get("spelling"))
-
-        if "lighthouse" in results:
-            check_result_obj.lighthouse_audits = results.get("lighthouse").get("results")
-            check_result_obj.lighthouse_score = results.get("lighthouse").get("score").get("performance")
-
-            # lighthouse problem #
-            if check_result_obj.lighthouse_score < 0.75:
-                check_failed_message += "Warning: Lighthouse score degraded\n{}\n".format(
-                    check_result_obj.url)
-
-        if "links" in results:
-            check_result_obj.links_failed_count = results["links"]["failed"]
-            check_result_obj.links_results = json.dumps(results["links"]["results"])
-
-            # dead links problem #
-            if check_result_obj.links_failed_count > 0:
-                check_failed_message += "Warning: Dead Links on Website ->\n"
-                failed_links = [ list(el.keys())[0] for el in results["links"]["results"]
-                                         if not list(el.values())[0] ]
-                check_failed_message += "\n".join(failed_links)
-
-        # overall fail ? #
-        # check = False (fail) if message is non-empty #
-        check_result_obj.base_check = not bool(check_failed_message)
-        check_result_obj.check_failed_message = check_failed_message
-
-        # add and commit #
-        db.session.add(check_result_obj)
-        db.session.commit()
+    if not jdict.get("check"):
+        return ("Submission contains no checks", 400)
 
-        # try to get last #
-        last_q = db.session.query(CheckResult).filter(
-                    and_(CheckResult.parent==URL.uuid,
-                         CheckResult.url==jdict["url"],
-                         not_(CheckResult.uuid==check_result_obj.uuid))).order_by(CheckResult.timestamp.desc())
+    print("Submission for {} with {} page(s){}".format(url_obj.base_url, len(jdict["check"]),
+                " (partial crawl)" if jdict.get("partial") else ""))
+    db_writer.run(_ingest_submission, url_obj.uuid, jdict["check"])
 
-        last = last_q.first()
-
-        # dispatch configured and based check failed + either no last result or last was success #
-        if((not last and not check_result_obj.base_check)
-                or (last and last.base_check != check_result_obj.base_check)):
-
-            if check_result_obj.base_check:
-                # build recovery message payload #
-                payload = { "users": [url_obj.owner], "msg" : "{} recovered".format(check_result_obj.url) }
-            else:
-                # build error message payload #
-                payload = { "users": [url_obj.owner], "msg" :
-                                "{}\n{}".format(check_result_obj.url, check_failed_message) }
-
-            # send dispatch #
-            if app.config.get("DISPATCH_SERVER"):
-                r = requests.post(app.config["DISPATCH_SERVER"] + "/smart-send",
-                                 json=payload, auth=app.config["DISPATCH_AUTH"])
-            else:
-                # dummy message if dispatch would have fired #
-                print("Dispatch would have fired (not configured) \n{}".format(json.dumps(payload, indent=2)))
-
-        return "OK"
-
-@app.route("/schedule-check", methods=["POST"])
-def schedule_check():
+    return "OK"
 
-    user = flask.request.json.get("owner") or "anonymous"
-    print(user)
-    url = flask.request.args.get("url")
+def _dictionary_words(owners):
+    '''Get the dictionary words of owners as { owner : (extra_words, full_ignore_words) }'''
 
-    if not url:
-        return ("Missing URL", 405)
+    words = { owner : ([], []) for owner in owners }
+    owners = list(owners)
+    for i in range(0, len(owners), 500):
+        for word in reads.query(DictionaryWord).filter(DictionaryWord.owner.in_(owners[i:i+500])):
+            words[word.owner][1 if word.full_ignore else 0].append(word.word)
 
-    url_obj = db.session.query(URL).filter(and_(URL.owner==user, URL.base_url==url)).first()
+    return words
 
-    if not url_obj:
-        return ("Combination of {} and {} does not exist".format(url, user), 404)
+def _build_push_dict(url_obj, overrides, words=([], [])):
+    '''Build the queue message for an URL, overrides being a scheduling request and
+       words the owner's (extra_words, full_ignore_words)'''
 
     push_dict = {
         "url" : url_obj.base_url,
-        "spelling_full_ignore_words" : "",
-        "spelling_extra_words" : "",
+        "spelling_full_ignore_words" : words[1],
+        "spelling_extra_words" : words[0],
         "check_spelling" : url_obj.check_spelling,
         "check_lighthouse" : url_obj.check_lighthouse,
         "check_links"  : url_obj.check_links,
@@ -306,24 +877,110 @@ def schedule_check():
         "token" : url_obj.token,
     }
 
+    # identifies this dispatch, so workers only skip redeliveries of the same message #
+    if overrides.get("due"):
+        push_dict.update({ "dispatch_id" : "{}-{}".format(url_obj.uuid, overrides["due"]) })
+    else:
+        push_dict.update({ "dispatch_id" : uuid.uuid4().hex })
+
     # force run #
-    if flask.request.args.get("force-run") == "1" or flask.request.json.get("force-run"):
+    if overrides.get("force-run"):
         push_dict.update({ "force_run" : True })
 
     # overwrite from request #
     for info in ["check_spelling", "check_lighthouse", "check_links"]:
-        if info in flask.request.json:
-            push_dict.update({ info : flask.request.json[info] })
+        if info in overrides:
+            push_dict.update({ info : overrides[info] })
+
+    return push_dict
+
+def _queue_name(url_obj):
+    return publisher.queue_for_group(app.config["QUEUE_NAME"], url_obj.master_host,
+                                        app.config["QUEUE_GROUPS"])
+
+@app.route("/schedule-check", methods=["POST"])
+def schedule_check():
+
+    user = flask.request.json.get("owner") or "anonymous"
+    print(user)
+    url = flask.request.args.get("url")
+
+    if not url:
+        return ("Missing URL", 405)
 
-    connection = pika.BlockingConnection(pika.ConnectionParameters(app.config["QUEUE_HOST"]))
-    channel = connection.channel()
-    channel.queue_declare(queue='scheduled')
-    print(push_dict)
-    channel.basic_publish(exchange='', routing_key='scheduled', body=json.dumps(push_dict))
-    connection.close()
+    url_obj = reads.query(URL).filter(and_(URL.owner==user, URL.base_url==url)).first()
+
+    if not url_obj:
+        return ("Combination of {} and {} does not exist".format(url, user), 404)
+
+    overrides = dict(flask.request.json)
+    if flask.request.args.get("force-run") == "1":
+        overrides.update({ "force-run" : True })
+
+    words = _dictionary_words([url_obj.owner])
+    push_dict = _build_push_dict(url_obj, overrides, words[url_obj.owner])
+
+    try:
+        confirm = queue_publisher.publish(json.dumps(push_dict), _queue_name(url_obj))
+        confirm.result(timeout=app.config["PUBLISH_TIMEOUT"])
+    except publisher.BufferFull as e:
+        return (str(e), 503)
+    except concurrent.futures.TimeoutError:
+        return ("Queue unavailable, check buffered", 202)
 
     return "OK"
 
+@app.route("/schedule-checks", methods=["POST"])
+def schedule_checks():
+    '''Schedule a list of checks (same fields as /schedule-check plus base_url),
+       returns a list with the outcome for each of them'''
+
+    specs = flask.request.json
+    if not isinstance(specs, list):
+        return ("Expected a list of checks", 400)
+
+    # resolve all URLs at once, chunked to stay below the bind parameter limit #
+    base_urls = list({ spec.get("base_url") or spec.get("url") for spec in specs })
+    url_objs = dict()
+    for i in range(0, len(base_urls), 500):
+        chunk = base_urls[i:i+500]
+        for url_obj in reads.query(URL).filter(URL.base_url.in_(chunk)).all():
+            url_objs.update({ (url_obj.owner, url_obj.base_url) : url_obj })
+
+    words = _dictionary_words({ owner for owner, base_url in url_objs })
+
+    # hand all messages to the publisher before waiting for any confirm #
+    outcomes = []
+    confirms = dict()
+    for spec in specs:
+
+        url = spec.get("base_url") or spec.get("url")
+        outcome = { "url" : url, "status" : "queued" }
+        outcomes.append(outcome)
+
+        url_obj = url_objs.get((spec.get("owner") or "anonymous", url))
+        if not url_obj:
+            outcome.update({ "status" : "not-found" })
+            continue
+
+        outcome.update({ "check_interval" : url_obj.effective_check_interval() })
+
+        try:
+            push_dict = _build_push_dict(url_obj, spec, words[url_obj.owner])
+            confirm = queue_publisher.publish(json.dumps(push_dict), _queue_name(url_obj))
+            confirms.update({ confirm : outcome })
+        except publisher.BufferFull:
+            outcome.update({ "status" : "buffer-full" })
+
+    done, not_done = concurrent.futures.wait(confirms, timeout=app.config["PUBLISH_TIMEOUT"])
+    for confirm in done:
+        if confirm.exception():
+            confirms[confirm].update({ "status" : "rejected" })
+    for confirm in not_done:
+        confirms[confirm].update({ "status" : "buffered" })
+
+    return flask.jsonify(outcomes)
+
 def create_modify_entry(form, user):
 
     token = secrets.token_urlsafe(16)
@@ -342,11 +999,23 @@ def create_modify_entry(form, user):
                     check_links=form.check_links.data,
                     check_lighthouse=form.check_lighthouse.data,
                     check_spelling=form.check_spelling.data,
-                    master_host=form.master_host.data)
+                    master_host=form.master_host.data,
+                    check_interval=form.check_interval.data and form.check_interval.data*60,
+                    extended_interval=form.extended_interval.data and form.extended_interval.data*3600,
+                    adaptive=form.adaptive.data,
+                    partition=_partition(uuid_hidden),
+                    modified=time.time())
 
     db.session.merge(url_obj)
     db.session.commit()
 
+def _delete_url(url_uuid):
+
+    url_obj = db.session.get(URL, url_uuid)
+    if url_obj:
+        db.session.delete(url_obj)
+        db.session.commit()
+
 @app.route("/check-details")
 def check_details():
 
@@ -357,18 +1026,118 @@ def check_details():
         return ("Missing '?url=...' argument", 404)
 
     # check url #
-    url_obj = db.session.query(URL).filter(and_(URL.owner==user, URL.base_url==url)).first()
+    url_obj = reads.query(URL).filter(and_(URL.owner==user, URL.base_url==url)).first()
     if not url_obj:
         return ("Combination of {} and {} does not exist".format(url, user), 404)
 
     return flask.render_template("service_info.html", url_check_obj=url_obj)
 
+def _history_buckets(query, bucket, buckets):
+    '''Run an aggregated history query and merge its rows into buckets'''
+
+    for row in query.group_by(bucket).all():
+
+        if row.bucket is None or not 0 <= row.bucket < len(buckets):
+            continue
+
+        target = buckets[row.bucket]
+        target["checks"] += row.checks or 0
+        target["failures"] += row.failures or 0
+        target["lighthouse_sum"] += row.lighthouse_sum or 0
+        target["lighthouse_count"] += row.lighthouse_count or 0
+        target["links_failed"] += row.links_failed or 0
+        target["spelling_failed"] += row.spelling_failed or 0
+
+        if row.lighthouse_min is not None:
+            if target["lighthouse_min"] is None or row.lighthouse_min < target["lighthouse_min"]:
+                target["lighthouse_min"] = row.lighthouse_min
+
+@app.route("/api/history")
+def history():
+    '''Downsampled uptime, lighthouse, dead link and spelling series for an URL'''
+
+    user = flask.request.headers.get("X-Forwarded-Preferred-Username") or "anonymous"
+    url = flask.request.args.get("url")
+
+    if not url:
+        return ("Missing '?url=...' argument", 404)
+
+    url_obj = reads.query(URL).filter(and_(URL.owner==user, URL.base_url==url)).first()
+    if not url_obj:
+        return ("Combination of {} and {} does not exist".format(url, user), 404)
+
+    try:
+        now = datetime.datetime.now().timestamp()
+        to_ts = float(flask.request.args.get("to") or now)
+        from_ts = float(flask.request.args.get("from") or to_ts - 7*86400)
+        bucket_count = min(max(int(flask.request.args.get("buckets") or 100), 1), 1000)
+    except ValueError:
+        return ("Arguments from, to and buckets must be numbers", 400)
+
+    if from_ts >= to_ts:
+        return ("Argument from must be before to", 400)
+
+    buckets = [ { "start" : from_ts + i*(to_ts - from_ts)/bucket_count,
+                  "checks" : 0, "failures" : 0,
+                  "lighthouse_min" : None, "lighthouse_sum" : 0, "lighthouse_count" : 0,
+                  "links_failed" : 0, "spelling_failed" : 0 } for i in range(bucket_count) ]
+
+    def bucket_of(column):
+        return sqlalchemy.cast((column - from_ts) * bucket_count / (to_ts - from_ts),
+                                Integer).label("bucket")
+
+    # raw results within retention, index only scan over ix_results_history #
+    bucket = bucket_of(CheckResult.timestamp)
+    raw = reads.query(bucket,
+                func.count().label("checks"),
+                func.sum(sqlalchemy.case((CheckResult.base_check == False, 1), else_=0)).label("failures"),
+                func.min(CheckResult.lighthouse_score).label("lighthouse_min"),
+                func.sum(CheckResult.lighthouse_score).label("lighthouse_sum"),
+                func.count(CheckResult.lighthouse_score).label("lighthouse_count"),
+                func.sum(CheckResult.links_failed_count).label("links_failed"),
+                func.sum(CheckResult.spelling_failed_count).label("spelling_failed")
+            ).filter(CheckResult.parent==url_obj.uuid,
+                     CheckResult.timestamp >= from_ts, CheckResult.timestamp < to_ts)
+    _history_buckets(raw, bucket, buckets)
+
+    # compacted results, daily roll-ups for long ranges to bound the rows read #
+    period = "hour" if to_ts - from_ts <= 90*86400 else "day"
+    bucket = bucket_of(ResultRollup.start)
+    rolled = reads.query(bucket,
+                func.sum(ResultRollup.checks).label("checks"),
+                func.sum(ResultRollup.failures).label("failures"),
+                func.min(ResultRollup.lighthouse_min).label("lighthouse_min"),
+                func.sum(ResultRollup.lighthouse_sum).label("lighthouse_sum"),
+                func.sum(ResultRollup.lighthouse_count).label("lighthouse_count"),
+                func.sum(ResultRollup.links_failed_count).label("links_failed"),
+                func.sum(ResultRollup.spelling_failed_count).label("spelling_failed")
+            ).filter(ResultRollup.parent==url_obj.uuid, ResultRollup.period==period,
+                     ResultRollup.start >= from_ts, ResultRollup.start < to_ts)
+    _history_buckets(rolled, bucket, buckets)
+
+    series = []
+    for b in buckets:
+        checks = b["checks"]
+        series.append({
+            "start" : b["start"],
+            "checks" : checks,
+            "uptime" : (checks - b["failures"]) / checks if checks else None,
+            "lighthouse_avg" : (b["lighthouse_sum"] / b["lighthouse_count"]
+                                    if b["lighthouse_count"] else None),
+            "lighthouse_min" : b["lighthouse_min"],
+            "dead_links" : b["links_failed"] / checks if checks else None,
+            "spelling_errors" : b["spelling_failed"] / checks if checks else None,
+        })
+
+    return flask.jsonify({ "url" : url_obj.base_url, "from" : from_ts, "to" : to_ts,
+                           "series" : series })
+
 @app.route("/create-modify", methods=["GET", "POST", "DELETE"])
 def form_endpoint():
 
     user = flask.request.headers.get("X-Forwarded-Preferred-Username") or "anonymous"
     url = flask.request.args.get("url")
-    url_obj = del_object = db.session.query(URL).filter(
+    url_obj = del_object = reads.query(URL).filter(
                     and_(URL.base_url==url, URL.owner==user)).first()
 
     # check if is delete #
@@ -378,8 +1147,7 @@ def form_endpoint():
         if not url_obj:
             return ("Failed to delete the requested service", 404)
 
-        db.session.delete(url_obj)
-        db.session.commit()
+        db_writer.run(_delete_url, url_obj.uuid)
 
         return flask.redirect("/")
 
@@ -393,6 +1161,9 @@ def form_endpoint():
         form.check_lighthouse.default = url_obj.check_lighthouse
         form.check_spelling.default = url_obj.check_spelling
         form.master_host.default = url_obj.master_host
+        form.check_interval.default = url_obj.check_interval and url_obj.check_interval//60
+        form.extended_interval.default = url_obj.extended_interval and url_obj.extended_interval//3600
+        form.adaptive.default = url_obj.adaptive
         form.uuid_hidden.default = url_obj.uuid
         form.process()
     elif url:
@@ -400,7 +1171,7 @@ def form_endpoint():
 
     if flask.request.method == "POST":
         if form.validate():
-            create_modify_entry(form, user)
+            db_writer.run(create_modify_entry, form, user)
             service_name = form.url.data
             return flask.redirect('/check-details?url={}'.format(service_name))
         else:
@@ -413,15 +1184,78 @@ def form_endpoint():
 def index():
 
     user = flask.request.headers.get("X-Forwarded-Preferred-Username") or "anonymous"
-    url_checks = db.session.query(URL).filter(URL.owner==user).all()
+    url_checks = reads.query(URL).filter(URL.owner==user).all()
     return flask.render_template("overview.html", user=user, config=app.config,
                 url_checks=url_checks)
 
+def _add_missing_columns():
+    '''Add (nullable) columns introduced after a table was created by create_all'''
+
+    inspector = sqlalchemy.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+
+            existing = [ c["name"] for c in inspector.get_columns(table.name) ]
+            for column in table.columns:
+
+                if column.name in existing:
+                    continue
+
+                print("Adding column {}.{}".format(table.name, column.name), file=sys.stderr)
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(sqlalchemy.text("ALTER TABLE {} ADD COLUMN {} {}".format(
+                                        table.name, column.name, column_type)))
+
+@app.teardown_appcontext
+def _remove_read_session(exception=None):
+    if reads:
+        reads.remove()
+
 def create_app():
 
     # prepare database #
+    storage.tune_engine(db.engine)
     db.create_all()
 
+    _add_missing_columns()
+
+    # create_all skips indices on existing tables #
+    for index in list(CheckResult.__table__.indexes) + list(URL.__table__.indexes):
+        index.create(bind=db.engine, checkfirst=True)
+
+    # backfill latest results for URLs checked before they were tracked #
+    for url_obj in db.session.query(URL).filter(~URL.latest.has()).all():
+        last = url_obj.last_result()
+        if last:
+            _update_latest(url_obj, [last])
+    db.session.commit()
+
+    # backfill status changes for latest results recorded before they were tracked #
+    for latest in db.session.query(LatestResult).filter(LatestResult.status_changed.is_(None)).all():
+        latest.status_changed = _status_changed(latest.parent, latest.base_check) or latest.timestamp
+    db.session.commit()
+
+    # read only connection pool & single writer for concurrent requests #
+    global reads
+    global db_writer
+    reads = storage.create_read_session(db.engine,
+                            pool_size=int(os.environ.get("DATABASE_READ_POOL_SIZE") or 8))
+    db_writer = storage.WriteQueue(app, db)
+    db_writer.start()
+
+    # default seconds between basic and extended checks of an URL #
+    app.config["CHECK_INTERVAL"] = int(os.environ.get("CHECK_INTERVAL") or 300)
+    app.config["EXTENDED_CHECK_INTERVAL"] = int(os.environ.get("EXTENDED_CHECK_INTERVAL") or 5*3600)
+
+    # adaptive intervals back off by ADAPTIVE_FACTOR of the time without status change #
+    app.config["ADAPTIVE_MIN_INTERVAL"] = int(os.environ.get("ADAPTIVE_MIN_INTERVAL") or 60)
+    app.config["ADAPTIVE_MAX_INTERVAL"] = int(os.environ.get("ADAPTIVE_MAX_INTERVAL") or 3600)
+    app.config["ADAPTIVE_FACTOR"] = float(os.environ.get("ADAPTIVE_FACTOR") or 0.1)
+
+    # URLs are split into partitions, each owned by one scheduler at a time #
+    app.config["SCHEDULER_PARTITIONS"] = int(os.environ.get("SCHEDULER_PARTITIONS") or 64)
+    db_writer.run(_assign_partitions)
+
     # set dispatch server info #
     app.config["DISPATCH_SERVER"] = os.environ.get("DISPATCH_SERVER")
     if not app.config["DISPATCH_SERVER"]:
@@ -430,20 +1264,41 @@ def create_app():
         app.config["DISPATCH_AUTH"] = (os.environ["DISPATCH_AUTH_USER"],
                                        os.environ["DISPATCH_AUTH_PASSWORD"])
 
+    # start sending notifications from the outbox #
+    app.config["DISPATCH_TIMEOUT"] = float(os.environ.get("DISPATCH_TIMEOUT") or 10)
+    app.config["NOTIFICATION_INTERVAL"] = float(os.environ.get("NOTIFICATION_INTERVAL") or 10)
+    app.config["NOTIFICATION_BACKOFF"] = float(os.environ.get("NOTIFICATION_BACKOFF") or 30)
+    app.config["NOTIFICATION_MAX_BACKOFF"] = float(os.environ.get("NOTIFICATION_MAX_BACKOFF") or 3600)
+    app.config["NOTIFICATION_MAX_ATTEMPTS"] = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS") or 20)
+    threading.Thread(target=_notification_loop, daemon=True,
+                     args=(app.config["NOTIFICATION_INTERVAL"],)).start()
+
     # set rabbitmq connection #
     app.config["QUEUE_HOST"] = os.environ.get("QUEUE_HOST")
-
-    # check pika connection #
-    for i in range(0,5):
-        try:
-            test_c = pika.BlockingConnection(pika.ConnectionParameters(app.config["QUEUE_HOST"]))
-            test_c.close()
-            break
-        except pika.exceptions.AMQPConnectionError as e:
-            print(e, file=sys.stderr)
-
-        print("Retrying in... {}s".format(i*60))
-        time.sleep(i*20)
+    app.config["QUEUE_NAME"] = os.environ.get("QUEUE_NAME") or "scheduled"
+
+    # groups with a queue of their own, all others share the base queue #
+    app.config["QUEUE_GROUPS"] = { g.strip() for g in (os.environ.get("QUEUE_GROUPS") or "").split(",")
+                                        if g.strip() }
+
+    # start shared publisher, it connects and reconnects in the background #
+    global queue_publisher
+    app.config["PUBLISH_TIMEOUT"] = float(os.environ.get("PUBLISH_TIMEOUT") or 5)
+    queue_publisher = publisher.Publisher(app.config["QUEUE_HOST"],
+                            buffer_size=int(os.environ.get("PUBLISH_BUFFER_SIZE") or 10000))
+    queue_publisher.start()
+
+    # start result retention & compaction #
+    app.config["RESULT_RETENTION_DAYS"] = float(os.environ.get("RESULT_RETENTION_DAYS") or 30)
+    app.config["COMPACTION_BATCH_SIZE"] = int(os.environ.get("COMPACTION_BATCH_SIZE") or 500)
+    app.config["COMPACTION_INTERVAL"] = float(os.environ.get("COMPACTION_INTERVAL") or 10)
+    if app.config["RESULT_RETENTION_DAYS"] > 0:
+        threading.Thread(target=_compaction_loop, daemon=True,
+                         args=(app.config["RESULT_RETENTION_DAYS"],
+                               app.config["COMPACTION_BATCH_SIZE"],
+                               app.config["COMPACTION_INTERVAL"]*60)).start()
+    else:
+        print("Warning: Result retention disabled, results table will grow", file=sys.stderr)
 
     # set secret for CSRF #
     app.config["SECRET_KEY"] = secrets.token_urlsafe(64)
@@ -0,0 +1,107 @@
+import os
+import sys
+import queue
+import threading
+import concurrent.futures
+
+import sqlalchemy
+import sqlalchemy.orm
+
+DEFAULT_DATABASE_URI = "sqlite:///sqlite.db"
+
+def database_uri():
+    '''Database URI from env:DATABASE_URI, defaults to a local SQLite file'''
+    return os.environ.get("DATABASE_URI") or DEFAULT_DATABASE_URI
+
+def engine_options(uri):
+    '''SQLAlchemy engine options for the write engine'''
+
+    if not uri.startswith("sqlite"):
+        return {}
+
+    # connections are handed between request threads and the writer thread #
+    return { "connect_args" : { "check_same_thread" : False, "timeout" : 30 } }
+
+def _set_pragmas(dbapi_connection, read_only):
+
+    cursor = dbapi_connection.cursor()
+
+    # WAL is persistent in the database file, read only connections can't set it #
+    if not read_only:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    else:
+        cursor.execute("PRAGMA query_only=ON")
+
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-{}".format(int(os.environ.get("SQLITE_CACHE_SIZE_KB") or 65536)))
+    cursor.execute("PRAGMA mmap_size={}".format(int(os.environ.get("SQLITE_MMAP_SIZE") or 268435456)))
+    cursor.close()
+
+def tune_engine(engine, read_only=False):
+    '''Apply the SQLite pragmas to every new connection of an engine'''
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, read_only)
+
+def create_read_session(engine, pool_size=8):
+    '''Create a thread local session on a pool of read only connections to the
+       database of the given (write) engine'''
+
+    if engine.dialect.name != "sqlite" or not engine.url.database:
+        read_engine = engine
+    else:
+        read_uri = "sqlite:///file:{}?mode=ro&uri=true".format(os.path.abspath(engine.url.database))
+        read_engine = sqlalchemy.create_engine(read_uri, poolclass=sqlalchemy.pool.QueuePool,
+                            pool_size=pool_size,
+                            connect_args={ "check_same_thread" : False, "timeout" : 30 })
+        tune_engine(read_engine, read_only=True)
+
+    return sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker(bind=read_engine))
+
+class WriteQueue:
+    '''Serialize all database writes through a single thread.
+
+       SQLite allows only one writer at a time, concurrent writers wait on the file
+       lock and eventually fail with "database is locked". Jobs run in order in their
+       own app context and commit themselves, callers wait on the returned future.'''
+
+    def __init__(self, app, db):
+
+        self.app = app
+        self.db = db
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        '''Queue a write job, returns a future for its return value'''
+
+        future = concurrent.futures.Future()
+        self.jobs.put((function, args, kwargs, future))
+        return future
+
+    def run(self, function, *args, **kwargs):
+        '''Run a write job and wait for its return value'''
+        return self.submit(function, *args, **kwargs).result()
+
+    def _run(self):
+
+        while True:
+
+            function, args, kwargs, future = self.jobs.get()
+
+            with self.app.app_context():
+                try:
+                    future.set_result(function(*args, **kwargs))
+                except Exception as e:
+                    print("Write failed: {}".format(repr(e)), file=sys.stderr)
+                    self.db.session.rollback()
+                    future.set_exception(e)
@@ -0,0 +1,286 @@
+import os
+import heapq
+import random
+import socket
+import requests
+
+class Entry:
+    '''Scheduling state of one URL'''
+
+    def __init__(self, spec):
+
+        self.uuid = spec["uuid"]
+        self.spec = spec
+        self.next_check = None
+        self.next_extended = None
+
+    @property
+    def check_interval(self):
+        return self.spec["check_interval"]
+
+    @property
+    def extended_interval(self):
+        return self.spec["extended_interval"]
+
+    def has_extended(self):
+        return any(self.spec.get(key) for key in ("check_links", "check_lighthouse", "check_spelling"))
+
+class Schedule:
+    '''Next due times of all URLs in a heap, so each URL is scheduled on its own
+       interval instead of all of them on a common tick.
+
+       Every interval is randomized by +/- jitter (a fraction of it) and URLs which
+       are overdue when first seen are spread over the jitter window, so checks
+       don't line up after a restart or when many URLs are added at once. Heap
+       items of rescheduled or removed URLs are skipped when they come up.'''
+
+    def __init__(self, jitter=0.1):
+
+        self.jitter = jitter
+        self.entries = dict()
+        self.heap = []
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _push(self, entry):
+        self.counter += 1
+        heapq.heappush(self.heap, (entry.next_check, self.counter, entry.uuid))
+
+    def _first_due(self, last, interval, now):
+        '''Due time from the last run, overdue runs are spread over the jitter window'''
+
+        if last is not None and last + interval > now:
+            return last + interval
+        return now + random.uniform(0, interval * self.jitter)
+
+    def update(self, spec, now):
+        '''Add or update an URL from a master schedule entry'''
+
+        if spec.get("disabled"):
+            self.remove(spec["uuid"])
+            return
+
+        entry = self.entries.get(spec["uuid"])
+
+        # keep the due times of known URLs unless their intervals changed #
+        if entry and entry.check_interval == spec["check_interval"] \
+                 and entry.extended_interval == spec["extended_interval"]:
+            entry.spec = spec
+            return
+
+        entry = Entry(spec)
+        entry.next_check = self._first_due(spec.get("last_check"), entry.check_interval, now)
+        entry.next_extended = self._first_due(spec.get("last_extended"), entry.extended_interval, now)
+
+        self.entries.update({ entry.uuid : entry })
+        self._push(entry)
+
+    def replace(self, specs, now):
+        '''Full sync, URLs missing in specs are dropped'''
+
+        uuids = { spec["uuid"] for spec in specs }
+        for uuid in [ u for u in self.entries if u not in uuids ]:
+            self.remove(uuid)
+
+        for spec in specs:
+            self.update(spec, now)
+
+    def remove(self, uuid):
+        self.entries.pop(uuid, None)
+
+    def _valid(self, item):
+        due, counter, uuid = item
+        entry = self.entries.get(uuid)
+        return entry and entry.next_check == due
+
+    def next_due(self):
+        '''Time of the next due check or None'''
+
+        while self.heap and not self._valid(self.heap[0]):
+            heapq.heappop(self.heap)
+
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now, limit):
+        '''Take up to limit due entries off the heap, they must be rescheduled with
+           done() or retry()'''
+
+        due = []
+        while len(due) < limit:
+
+            next_due = self.next_due()
+            if next_due is None or next_due > now:
+                break
+
+            due_time, counter, uuid = heapq.heappop(self.heap)
+            due.append(self.entries[uuid])
+
+        return due
+
+    def extended_due(self, entry, now):
+        return entry.has_extended() and entry.next_extended <= now
+
+    def done(self, entry, now, extended):
+        '''Schedule the next run of an entry which was just queued'''
+
+        if entry.uuid not in self.entries:
+            return
+
+        entry.next_check = now + self._jittered(entry.check_interval)
+        if extended:
+            entry.next_extended = now + self._jittered(entry.extended_interval)
+
+        self._push(entry)
+
+    def retry(self, entry, now, delay):
+        '''Try an entry which could not be queued again after delay seconds'''
+
+        if entry.uuid not in self.entries:
+            return
+
+        entry.next_check = now + delay
+        self._push(entry)
+
+class SchedulerEngine:
+    '''Keeps a Schedule in sync with the master and hands due checks to it in
+       batches. Syncs are incremental (only URLs modified since the last sync),
+       with a full sync every full_sync_interval seconds to pick up deletions.
+
+       Several engines can run side by side: each one holds a lease on a share of
+       the master's URL partitions, renewed every lease_interval seconds, and only
+       schedules URLs in those partitions. Partitions of an engine which stopped
+       renewing are taken over once its lease expired.'''
+
+    def __init__(self, master_host, jitter=0.1, sync_interval=60, full_sync_interval=3600,
+                    batch_size=500, retry_delay=30, timeout=30, lease_interval=30):
+
+        self.master_host = master_host
+        self.schedule = Schedule(jitter)
+
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self.since = None
+        self.next_sync = 0
+        self.next_full_sync = 0
+
+        self.holder = "{}-{}-{:x}".format(socket.gethostname(), os.getpid(), random.getrandbits(32))
+        self.lease_interval = lease_interval
+        self.next_lease = 0
+        self.partitions = []
+
+    def renew_lease(self, now):
+        '''Renew the partition lease, returns the held partitions'''
+
+        r = requests.post(self.master_host + "/scheduler-lease", timeout=self.timeout,
+                            json={ "holder" : self.holder, "ttl" : self.lease_interval*3 })
+        r.raise_for_status()
+        partitions = r.json()["partitions"]
+
+        # partitions changed, re-read the schedule for the new set #
+        if partitions != self.partitions:
+            print("Holding {} partition(s): {}".format(len(partitions), partitions))
+            self.partitions = partitions
+            self.next_sync = 0
+            self.next_full_sync = 0
+
+        self.next_lease = now + self.lease_interval
+        return partitions
+
+    def sync(self, now):
+
+        full = now >= self.next_full_sync
+        params = { "partitions" : ",".join(str(p) for p in self.partitions) }
+        if not full:
+            params.update({ "since" : self.since })
+
+        if not self.partitions:
+            response = { "timestamp" : now, "urls" : [] }
+        else:
+            r = requests.get(self.master_host + "/get-check-schedule", params=params,
+                                timeout=self.timeout)
+            r.raise_for_status()
+            response = r.json()
+
+        if full:
+            self.schedule.replace(response["urls"], now)
+            self.next_full_sync = now + self.full_sync_interval
+        else:
+            for spec in response["urls"]:
+                self.schedule.update(spec, now)
+
+        # overlap syncs a little, so changes committed during a sync aren't missed #
+        self.since = response["timestamp"] - self.sync_interval
+        self.next_sync = now + self.sync_interval
+
+        return len(response["urls"])
+
+    def _message(self, entry, extended):
+
+        spec = dict(entry.spec)
+
+        # the due time identifies this run of the URL, also if it's sent again #
+        spec.update({ "due" : entry.next_check })
+        if not extended:
+            spec.update({ "check_links" : False,
+                          "check_lighthouse" : False,
+                          "check_spelling" : False })
+
+        return spec
+
+    def dispatch(self, now):
+        '''Schedule all due checks, returns the number of queued checks'''
+
+        queued = 0
+        while True:
+
+            due = self.schedule.pop_due(now, self.batch_size)
+            if not due:
+                return queued
+
+            extended = [ self.schedule.extended_due(entry, now) for entry in due ]
+            messages = [ self._message(entry, e) for entry, e in zip(due, extended) ]
+
+            try:
+                r = requests.post(self.master_host + "/schedule-checks", json=messages,
+                                    timeout=self.timeout)
+                r.raise_for_status()
+                outcomes = r.json()
+            except requests.exceptions.RequestException:
+                for entry in due:
+                    self.schedule.retry(entry, now, self.retry_delay)
+                raise
+
+            for entry, e, outcome in zip(due, extended, outcomes):
+
+                if outcome["status"] == "not-found":
+                    self.schedule.remove(entry.uuid)
+                elif outcome["status"] in ("queued", "buffered"):
+
+                    # the master may have adapted the interval to the URL's stability #
+                    if outcome.get("check_interval"):
+                        entry.spec["check_interval"] = outcome["check_interval"]
+
+                    self.schedule.done(entry, now, e)
+                    queued += 1
+                else:
+                    print("WARNING: {} {}".format(outcome["url"], outcome["status"]))
+                    self.schedule.retry(entry, now, self.retry_delay)
+
+    def sleep_time(self, now, max_sleep=60):
+        '''Seconds until the next due check, sync or lease renewal'''
+
+        wake = min(self.next_sync, self.next_lease)
+        next_due = self.schedule.next_due()
+        if next_due is not None:
+            wake = min(wake, next_due)
+
+        return min(max(wake - now, 0), max_sleep)
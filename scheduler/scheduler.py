@@ -4,13 +4,15 @@ import requests
 import time
 import argparse
 
+import engine
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Website Monitoring Scheduler',
                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument("-H", "--master-host", default="http://localhost:5000", help="Master Server to schedule")
-    parser.add_argument("-s", "--sleep-time", type=float, default=5, help="Run every x-minutes")
+    parser.add_argument("-s", "--sleep-time", type=float, default=5, help="Sync with master every x-minutes")
     args = parser.parse_args()
 
     master_host = args.master_host
@@ -25,19 +27,32 @@ if __name__ == "__main__":
     if os.environ.get("SLEEP_TIME"):
         sleep_time = float(os.environ.get("SLEEP_TIME"))
 
+    scheduler = engine.SchedulerEngine(master_host,
+                    jitter=float(os.environ.get("SCHEDULE_JITTER") or 0.1),
+                    sync_interval=sleep_time*60,
+                    full_sync_interval=float(os.environ.get("FULL_SYNC_INTERVAL") or 60)*60,
+                    batch_size=int(os.environ.get("SCHEDULE_BATCH_SIZE") or 500),
+                    lease_interval=float(os.environ.get("LEASE_INTERVAL") or 30))
+
     while(True):
 
+        now = time.time()
         try:
-            r = requests.get(master_host + "/get-check-info")
-            print(r.content)
-            for c in r.json():
-                print(c)
-                r = requests.post(master_host + "/schedule-check?url={}".format(
-                                    c["base_url"]), json=c)
-                r.raise_for_status()
-        except requests.exceptions.ConnectionError as e:
-            print(e)
+            if now >= scheduler.next_lease:
+                scheduler.renew_lease(now)
+            if now >= scheduler.next_sync:
+                print("Synced {} URL(s), {} scheduled".format(scheduler.sync(now), len(scheduler.schedule)))
+
+            queued = scheduler.dispatch(now)
+            if queued:
+                print("Scheduled {} check(s)".format(queued))
         except requests.HTTPError as e:
             print("WARNING:", e)
+            scheduler.next_sync = max(scheduler.next_sync, now + scheduler.retry_delay)
+            scheduler.next_lease = max(scheduler.next_lease, now + scheduler.retry_delay)
+        except requests.exceptions.RequestException as e:
+            print(e)
+            scheduler.next_sync = max(scheduler.next_sync, now + scheduler.retry_delay)
+            scheduler.next_lease = max(scheduler.next_lease, now + scheduler.retry_delay)
 
-        time.sleep(int(sleep_time*60))
+        time.sleep(max(scheduler.sleep_time(time.time()), 1))
@@ -0,0 +1,62 @@
+'''Compare the parse cost per MB of HTML before and after the shared document model'''
+
+import time
+import argparse
+import bs4
+import document
+
+def _synthetic_page(paragraphs):
+
+    links = "".join([ '<li><a href="/page-{0}">Page {0}</a></li>'.format(i) for i in range(50) ])
+    body = "".join([ "<p>Paragraph {} with some regular text, a <b>bold</b> word and a "
+                     '<a href="https://example.com/{}">link</a>.</p>'.format(i, i)
+                        for i in range(paragraphs) ])
+
+    return "<html><body><nav><ul>{0}</ul></nav>{1}<footer><ul>{0}</ul></footer></body></html>".format(
+                links, body).encode()
+
+def _parse_separately(body):
+    '''Previous behaviour, spelling, link and crawl stages each parsed the page'''
+
+    soup = bs4.BeautifulSoup(body, 'html.parser')
+    texts = [ child.get_text() for child in soup.find_all()
+                    if isinstance(child.string, bs4.NavigableString) ]
+
+    for stage in ("links", "crawl"):
+        soup = bs4.BeautifulSoup(body, 'html.parser')
+        hrefs = [ link.get('href') for link in soup.find_all('a') ]
+
+def _parse_shared(body):
+    document.Document("https://example.com", body)
+
+def _seconds_per_mb(function, body, rounds):
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        function(body)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / (rounds * len(body) / 1024 / 1024)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Parse Benchmark',
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-f", "--file", help="HTML file to parse instead of a synthetic page")
+    parser.add_argument("-r", "--rounds", type=int, default=20, help="Parses per measurement")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            body = f.read()
+    else:
+        body = _synthetic_page(2000)
+
+    before = _seconds_per_mb(_parse_separately, body, args.rounds)
+    after = _seconds_per_mb(_parse_shared, body, args.rounds)
+
+    print("Page size: {:.2f} MB".format(len(body)/1024/1024))
+    print("Before:    {:.3f} s/MB (3x html.parser)".format(before))
+    print("After:     {:.3f} s/MB (1x {})".format(after, document.PARSER))
+    print("Speedup:   {:.1f}x".format(before/after))
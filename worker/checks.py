@@ -1,16 +1,17 @@
 from lighthouse import LighthouseRunner
-import time
-import queue
 import re
-import pkg_resources
-import urllib.parse
-import symspellpy
+import os
 import requests
-import bs4
 import dateutil.parser
 import json
-
-DEFAULT_FREQUENCY = 100
+import urllib.parse
+import linkcheck
+import spelling
+import document
+import httpclient
+import fingerprints
+import chromepool
+import crawler
 
 def _check_base_status(status_code):
     return status_code in [301, 302, 200, 204]
@@ -28,192 +29,255 @@ def _clean_whitespaces(text):
 
     return ret
 
-def check_website_reachable(url):
+def check_website_reachable(url, headers=None):
+    '''Fetch an URL, returns (status, body, response headers), the body being capped at
+       env:MAX_BODY_BYTES and None for content which isn't HTML'''
+
+    max_bytes = int(os.environ.get("MAX_BODY_BYTES") or 5*1024*1024)
 
     try:
-        r = requests.get(url)
+        r, body = httpclient.fetch(url, max_bytes, headers=headers)
     except requests.exceptions.SSLError:
-        return (-1, "SSL Error")
+        return (-1, "SSL Error", {})
     except requests.exceptions.ConnectionError:
-        return (-2, "Could not resolve DNS")
+        return (-2, "Could not resolve DNS", {})
+    except requests.exceptions.Timeout:
+        return (-3, "Timeout", {})
+    except requests.exceptions.RequestException as e:
+        # broken transfers, redirect loops, invalid URLs.. #
+        return (-4, "Request failed: {}".format(repr(e)), {})
 
-    return (r.status_code, r.content)
+    return (r.status_code, body, r.headers)
 
 def check_lighthouse_f(url):
 
-    TIMINGS = [
-        'speed-index'
-    ]
-    report = LighthouseRunner(url, form_factor='desktop', quiet=False, timings=TIMINGS).report
+    pool = chromepool.get_pool()
+
+    # without pool, every run launches its own browser #
+    if not pool:
+
+        TIMINGS = [
+            'speed-index'
+        ]
+        report = LighthouseRunner(url, form_factor='desktop', quiet=False, timings=TIMINGS).report
+
+        ret = {
+            "score": report.score,
+            "audits": json.dumps(report.audits())
+        }
+
+        return ret
+
+    lhr = pool.run(url)
+    audits = { key : { "title" : audit.get("title"), "score" : audit.get("score"),
+                       "displayValue" : audit.get("displayValue") }
+                            for key, audit in lhr.get("audits", {}).items()
+                            if audit.get("score") is not None }
 
     ret = {
-        "score": report.score,
-        "audits": json.dumps(report.audits())
+        "score": { "performance" : lhr["categories"]["performance"]["score"] },
+        "audits": json.dumps(audits)
     }
 
     return ret
 
-def check_spelling_f(body, extra_words=[], full_ignore=[]):
+def _spelling_verdict(sym_spell, t_clean):
+    '''Get the suggested correction for a cleaned text fragment, None if it is fine'''
+
+    # skip dates #
+    try:
+        dateutil.parser.parse(t_clean, fuzzy=True)
+        return None
+    except dateutil.parser._parser.ParserError:
+        pass
+
+    suggestions = sym_spell.lookup_compound(t_clean, max_edit_distance=2, transfer_casing=True)
+
+    print("===============================")
+    for suggestion in suggestions:
+
+        if suggestion.distance == 0:
+            continue
+        elif len(t_clean) <= 1:
+            continue
+
+        # skip very high distances - indicative of non-text being analyzed #
+        if (suggestion.distance/len(suggestion.term) > 0.5 or
+            (len(suggestion.term) > 20 and suggestion.distance/len(suggestion.term) > 0.2)):
+            continue
+
+        old_diff = re.sub(r'[\s.’\':,-]', '', t_clean)
+        new_diff = re.sub(r'[\s.’\':,-]', '', suggestion.term)
+        if old_diff == new_diff:
+            continue
 
-    sym_spell = symspellpy.SymSpell(max_dictionary_edit_distance=2, prefix_length=7)
-    dictionary_path = pkg_resources.resource_filename("symspellpy", "frequency_dictionary_en_82_765.txt")
-    bigram_path = pkg_resources.resource_filename("symspellpy", "frequency_bigramdictionary_en_243_342.txt")
+        return str(suggestion)
 
-    sym_spell.load_dictionary(dictionary_path, term_index=0, count_index=1)
-    sym_spell.load_bigram_dictionary(bigram_path, term_index=0, count_index=2)
+    return None
 
-    for w in extra_words:
-        sym_spell.create_dictionary_entry(w, DEFAULT_FREQUENCY)
+def check_spelling_f(doc, extra_words=[], full_ignore=[]):
 
-    # get all texts from page #
-    soup = bs4.BeautifulSoup(body, 'html.parser')
-    texts = [ child.get_text() for child in soup.find_all()
-                    if isinstance(child.string, bs4.NavigableString) ]
+    sym_spell = spelling.get_dictionary()
+    overlay_key, overlay = spelling.get_overlay(extra_words, full_ignore)
+    cache = spelling.get_fragment_cache()
 
     ret = dict()
-    for t in texts:
+    for t in doc.texts:
 
-        t_clean = _clean_whitespaces(t)
+        t_clean = _clean_whitespaces(overlay.strip(t))
 
         # skip empty strings #
         if not t_clean:
             continue
 
-        # skip dates #
-        try:
-            dateutil.parser.parse(t_clean, fuzzy=True)
-            continue
-        except dateutil.parser._parser.ParserError:
-            pass
+        # navigation, headers & footers repeat on every page #
+        key = spelling.fragment_key(overlay_key, t_clean)
+        found, verdict = cache.get(key)
+        if not found:
+            verdict = _spelling_verdict(sym_spell, t_clean)
+            cache.put(key, verdict)
 
-        suggestions = sym_spell.lookup_compound(t_clean, max_edit_distance=2, transfer_casing=True)
+        if verdict:
+            ret.update({ t : verdict })
 
-        print("===============================")
-        for suggestion in suggestions:
+    return ret
 
-            if suggestion.distance == 0:
-                continue
-            elif len(t_clean) <= 1:
-                continue
+def _probe_link(url):
+    '''Check if a link is alive, HEAD first, a streamed GET (body is never read) if
+       HEAD fails or is not supported by the server'''
 
-            # skip very high distances - indicative of non-text being analyzed #
-            if (suggestion.distance/len(suggestion.term) > 0.5 or
-                (len(suggestion.term) > 20 and suggestion.distance/len(suggestion.term) > 0.2)):
-                continue
+    try:
+        r = httpclient.get_session().head(url, allow_redirects=True)
+        if _check_base_status(r.status_code):
+            return True
+    except requests.exceptions.RequestException:
+        pass
 
-            old_diff = re.sub(r'[\s.’\':,-]', '', t_clean)
-            new_diff = re.sub(r'[\s.’\':,-]', '', suggestion.term)
-            if old_diff == new_diff:
-                continue
+    try:
+        return _check_base_status(httpclient.probe(url))
+    except requests.exceptions.RequestException:
+        return False
 
-            ret.update({ t : str(suggestion) })
-            break
+def check_links_f(doc, link_cache=None):
 
-    return ret
+    # internal and external links #
+    links = _links_for_document(doc, internal_only=False)
 
-def check_links_f(url, body):
+    # links to the checked site itself get the higher site rate #
+    site = urllib.parse.urlsplit(doc.url).hostname
 
     results = []
-    urls_queued = dict()
-    urls_todo = queue.Queue()
-    _put_urls_for_body(body, urls_todo, urls_queued, current_url=url)
-
     failed_count = 0
-    while not urls_todo.empty():
-
-        cur = urls_todo.get()
-        previous_hostname = urllib.parse.urlparse(url).hostname
-        cur_hostname = urllib.parse.urlparse(cur).hostname
-        if previous_hostname == cur_hostname:
-            print("no backoff for internal url: {}".format(cur))
-        else:
-            print("backoff for external url: {}".format(cur))
-            time.sleep(1)
-        result, body = check_url(cur, False, False, False)
-        failed = not result["base_status"]
-        results.append({ cur : not failed })
-
-        if failed:
+    for link, ok in linkcheck.get_checker(_probe_link).check(links, link_cache, site):
+
+        results.append({ link : ok })
+
+        if not ok:
             failed_count += 1
 
     return { "failed" : failed_count, "results" : results }
 
-def _put_urls_for_body(body, urls_todo, urls_queued, current_url):
-    '''Update the link queue with new links from a give body of HTML'''
-
-    # parse body and get hrefs #
-    soup = bs4.BeautifulSoup(body, 'html.parser')
-    links = soup.find_all('a')
-    link_list = [link.get('href') for link in links]
+def _links_for_document(doc, internal_only=True):
+    '''Get the unique http(s) links of a parsed page'''
 
-    for l in link_list:
+    ret = []
+    for l in doc.hrefs:
 
         # skip empty #
         if not l:
             continue
 
         # skip special links #
-        print(l)
-        if l.startswith(("tel:", "steam:", "xdg-open:", "mailto:")):
+        if l.startswith(crawler.SPECIAL_LINKS):
             print("Skipping... {}".format(l))
             continue
 
+        # absolute & canonical for pyrequests #
+        l = crawler.canonical_url(l, doc.url)
+        if not l.startswith(("http://", "https://")):
+            continue
+
         # check if internal URL #
-        link_parsed = urllib.parse.urlparse(l)
-        cur_url_parsed = urllib.parse.urlparse(current_url)
-        if link_parsed.netloc and link_parsed.netloc != cur_url_parsed.netloc:
+        if internal_only and not crawler.same_site(l, doc.url):
             continue
 
-        # add base for pyrequests #
-        if not link_parsed.netloc:
-            l = "{}://{}{}".format(cur_url_parsed.scheme, cur_url_parsed.netloc, link_parsed.path)
-            l = l.rstrip("/") # remove any tailing /
+        if l not in ret:
+            ret.append(l)
 
-        # check if url is already queued #
-        if l in urls_queued:
-            print("Skipping.. {}".format(l))
-            continue
-        else:
-            # queue and mark queued #
-            print("Queued.. {}".format(l))
-            urls_queued.update({l:True})
-            urls_todo.put(l)
+    return ret
 
 def check_url_recursive(url, check_lighthouse, check_links, check_spelling,
                             extra_words=[], full_ignore=[]):
+    '''Crawl a site and check each page, Lighthouse only runs on pages up to
+       env:CRAWL_LIGHTHOUSE_DEPTH (default only the start page)'''
 
-    results = dict()
-    urls_queued = dict()
-    urls_todo = queue.Queue()
-    urls_todo.put(url)
-
-    results.update({ "check" : [] })
+    # header & footer links are the same on every page, probe them once #
+    link_cache = linkcheck.new_cache()
+    lighthouse_depth = int(os.environ.get("CRAWL_LIGHTHOUSE_DEPTH") or 0)
 
-    while not urls_todo.empty():
+    def check_page(page, depth):
+        return check_url(page, check_lighthouse and depth <= lighthouse_depth, check_links,
+                            check_spelling, extra_words=extra_words, full_ignore=full_ignore,
+                            link_cache=link_cache)
 
-        result, body = check_url(urls_todo.get(), check_lighthouse, check_links, check_spelling,
-                                    extra_words, full_ignore)
+    pages, partial = crawler.get_crawler(check_page).crawl(url)
 
-        _put_urls_for_body(body, urls_todo, urls_queued, current_url=url)
-
-        # add to results #
-        results["check"].append((url, result))
+    results = { "check" : pages }
+    if partial:
+        results.update({ "partial" : True })
 
     return results
 
 def check_url(url, check_lighthouse, check_links, check_spelling, external_only=False,
-                extra_words=[], full_ignore=[]):
+                extra_words=[], full_ignore=[], link_cache=None):
 
     result_dict = dict()
 
-    status, body = check_website_reachable(url)
-    result_dict.update({"base_status" : _check_base_status(status) })
+    # previous state of the page, only useful if it holds all requested results #
+    store = fingerprints.get_store()
+    overlay_key = spelling.overlay_key(extra_words, full_ignore)
+    max_age = float(os.environ.get("FINGERPRINT_MAX_AGE") or 86400)
+    fingerprint = store.get(url)
+    if not fingerprints.can_reuse(fingerprint, check_spelling, check_links, overlay_key, max_age):
+        fingerprint = None
+
+    headers = fingerprints.conditional_headers(fingerprint) if fingerprint else None
+    status, body, response_headers = check_website_reachable(url, headers)
+
+    # health only depends on the status, 304 answers a conditional request #
+    base_status = _check_base_status(status) or status == 304
+    result_dict.update({"base_status" : base_status })
+
+    # unchanged if the server says so or the body is identical, never for errors #
+    body_hash = fingerprints.body_hash(body) if status > 0 else None
+    unchanged = base_status and fingerprint and (status == 304
+                        or (body_hash and body_hash == fingerprint["body_hash"]))
+
+    if unchanged:
+        doc = document.Document.from_hrefs(url, fingerprint["hrefs"])
+        reused = []
+        if check_spelling:
+            result_dict.update({ "spelling" : fingerprint["spelling"] })
+            reused.append("spelling")
+        if check_links:
+            result_dict.update({ "links" : fingerprint["links"] })
+            reused.append("links")
+        result_dict.update({ "reused" : reused })
+    else:
+        # parsed once for spelling, links and recursion, errors carry no HTML #
+        doc = document.Document(url, body if status > 0 else None)
+        if check_spelling:
+            result_dict.update({"spelling" : check_spelling_f(doc, extra_words, full_ignore)})
+        if check_links:
+            result_dict.update({"links" : check_links_f(doc, link_cache or linkcheck.new_cache())})
 
     if check_lighthouse:
         result_dict.update({"lighthouse" : check_lighthouse_f(url)})
-    if check_spelling:
-        result_dict.update({"spelling" : check_spelling_f(body, extra_words, full_ignore)})
-    if check_links:
-        result_dict.update({"links" : check_links_f(url, body)})
 
-    return (result_dict, body)
+    # remember the page to skip the work next time #
+    if not unchanged and body_hash and _check_base_status(status):
+        store.put(url, response_headers.get("ETag"), response_headers.get("Last-Modified"),
+                  body_hash, doc.hrefs, overlay_key,
+                  result_dict.get("spelling"), result_dict.get("links"))
+
+    return (result_dict, doc)
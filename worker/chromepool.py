@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+
+class ChromeInstance:
+    '''A headless Chromium with remote debugging enabled, Lighthouse connects to it
+       instead of launching a browser of its own'''
+
+    def __init__(self, chrome_bin, startup_timeout=20):
+
+        self.runs = 0
+        self.port = self._free_port()
+        self.user_data_dir = tempfile.mkdtemp(prefix="chrome-pool-")
+
+        self.process = subprocess.Popen([ chrome_bin, "--headless=new", "--no-sandbox", "--disable-gpu",
+                                          "--disable-dev-shm-usage", "--no-first-run",
+                                          "--remote-debugging-port={}".format(self.port),
+                                          "--user-data-dir={}".format(self.user_data_dir),
+                                          "about:blank" ],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # wait for the debugging port #
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError("Chrome did not start on port {}".format(self.port))
+                time.sleep(0.2)
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+class ChromePool:
+    '''Pool of long lived headless Chromium instances for Lighthouse audits.
+
+       At most size audits run at once, each on its own browser. Browsers are started
+       on demand and replaced after max_runs audits or a failure, which keeps their
+       memory growth in check.'''
+
+    def __init__(self, size, max_runs, chrome_bin, lighthouse_bin="lighthouse", timeout=180):
+
+        self.max_runs = max_runs
+        self.chrome_bin = chrome_bin
+        self.lighthouse_bin = lighthouse_bin
+        self.timeout = timeout
+
+        # a slot is None until its browser is first needed #
+        self.slots = queue.Queue()
+        for i in range(size):
+            self.slots.put(None)
+
+    def run(self, url):
+        '''Audit url for desktop performance, returns the Lighthouse result dict'''
+
+        instance = self.slots.get()
+        try:
+
+            if not instance or not instance.alive():
+                instance = ChromeInstance(self.chrome_bin)
+
+            cmd = [ self.lighthouse_bin, url, "--port={}".format(instance.port),
+                    "--output=json", "--output-path=stdout", "--quiet",
+                    "--preset=desktop", "--only-categories=performance" ]
+            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=self.timeout)
+            instance.runs += 1
+
+            if p.returncode != 0:
+                raise RuntimeError("Lighthouse failed for {}: {}".format(url, p.stderr.decode()[-500:]))
+
+            return json.loads(p.stdout)
+
+        except Exception:
+
+            # don't reuse a browser in an unknown state #
+            if instance:
+                instance.close()
+                instance = None
+            raise
+
+        finally:
+
+            if instance and instance.runs >= self.max_runs:
+                instance.close()
+                instance = None
+
+            self.slots.put(instance)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    '''Process wide pool configured from env, None if env:LIGHTHOUSE_POOL_SIZE is 0'''
+
+    global _pool
+
+    size = int(os.environ.get("LIGHTHOUSE_POOL_SIZE") or os.cpu_count() or 1)
+    if size <= 0:
+        return None
+
+    with _pool_lock:
+        if not _pool:
+            _pool = ChromePool(size,
+                        max_runs=int(os.environ.get("LIGHTHOUSE_MAX_RUNS") or 50),
+                        chrome_bin=os.environ.get("CHROME_BIN") or "chromium-browser",
+                        lighthouse_bin=os.environ.get("LIGHTHOUSE_BIN") or "lighthouse")
+            print("Lighthouse pool with {} browser(s)".format(size), file=sys.stderr)
+
+    return _pool
@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import collections
+import urllib.parse
+import concurrent.futures
+import xml.etree.ElementTree
+import requests
+
+import httpclient
+
+DEFAULT_PORTS = { "http" : 80, "https" : 443 }
+SPECIAL_LINKS = ("tel:", "steam:", "xdg-open:", "mailto:", "javascript:")
+
+def canonical_url(url, base=None):
+    '''Absolute form of an (optionally relative to base) URL, so the same page is
+       only crawled once: scheme and host are lowercased, default ports and the
+       fragment are dropped, an empty path becomes "/". The query is kept, as are
+       trailing slashes, relative links of /a and /a/ resolve differently.'''
+
+    if base:
+        url = urllib.parse.urljoin(base, url)
+
+    parsed = urllib.parse.urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+
+    netloc = (parsed.hostname or "").lower()
+    if ":" in netloc:
+        netloc = "[{}]".format(netloc)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = "{}:{}".format(netloc, port)
+    if parsed.username:
+        netloc = "{}@{}".format(parsed.username, netloc)
+
+    path = parsed.path or "/"
+
+    return urllib.parse.urlunsplit((scheme, netloc, path, parsed.query, ""))
+
+def same_site(url, other):
+    return urllib.parse.urlsplit(url).netloc == urllib.parse.urlsplit(other).netloc
+
+def sitemap_urls(url, max_bytes=10*1024*1024, max_sitemaps=10):
+    '''Page URLs listed in the sitemap.xml of url's site (following one level of
+       sitemap indices), an empty list if there is none'''
+
+    parsed = urllib.parse.urlsplit(url)
+    todo = [ "{}://{}/sitemap.xml".format(parsed.scheme, parsed.netloc) ]
+    pages = []
+    fetched = 0
+
+    while todo and fetched < max_sitemaps:
+
+        sitemap = todo.pop(0)
+        fetched += 1
+
+        try:
+            with httpclient.get_session().get(sitemap, stream=True) as r:
+                if r.status_code != 200:
+                    continue
+                body = r.raw.read(max_bytes, decode_content=True)
+            root = xml.etree.ElementTree.fromstring(body)
+        except (requests.exceptions.RequestException, xml.etree.ElementTree.ParseError) as e:
+            print("Cannot read sitemap {}: {}".format(sitemap, repr(e)), file=sys.stderr)
+            continue
+
+        locations = [ loc.text.strip() for loc in root.findall(".//{*}loc") if loc.text ]
+        if root.tag.endswith("sitemapindex"):
+            todo += locations
+        else:
+            pages += locations
+
+    return [ canonical_url(page) for page in pages ]
+
+class Crawler:
+    '''Breadth first crawl of a site, checking up to workers pages at once.
+
+       The crawl stops queuing pages after max_pages pages or budget seconds, links
+       of pages at max_depth are not followed. Pages already being checked when the
+       budget runs out are completed, the result is then marked as partial.
+
+       check_page(url, depth) checks one page and returns (result, document).'''
+
+    def __init__(self, check_page, max_depth=5, max_pages=500, budget=600, workers=4,
+                    use_sitemap=False):
+
+        self.check_page = check_page
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.budget = budget
+        self.workers = workers
+        self.use_sitemap = use_sitemap
+
+    def _links(self, doc, seed):
+        '''Canonical links of a page to other pages of the crawled site'''
+
+        links = []
+        for href in doc.hrefs:
+            if not href or href.startswith(SPECIAL_LINKS):
+                continue
+            link = canonical_url(href, doc.url)
+            if link.startswith(("http://", "https://")) and same_site(link, seed):
+                links.append(link)
+
+        return links
+
+    def crawl(self, url):
+        '''Returns (list of (page url, result), partial)'''
+
+        deadline = time.monotonic() + self.budget
+        seed = canonical_url(url)
+
+        frontier = collections.deque([ (seed, 0) ])
+        seen = { seed }
+        if self.use_sitemap:
+            for page in sitemap_urls(seed):
+                if page not in seen and same_site(page, seed):
+                    seen.add(page)
+                    frontier.append((page, 1))
+
+        results = []
+        started = 0
+        partial = False
+        in_flight = dict()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            while frontier or in_flight:
+
+                # refill, frontier is consumed in order to keep the crawl breadth first #
+                while frontier and len(in_flight) < self.workers:
+
+                    # the start page is always checked #
+                    if started and (started >= self.max_pages or time.monotonic() > deadline):
+                        print("Crawl of {} stopped after {} page(s), {} not checked".format(
+                                    seed, started, len(frontier)), file=sys.stderr)
+                        partial = True
+                        frontier.clear()
+                        break
+
+                    page, depth = frontier.popleft()
+                    in_flight.update({ executor.submit(self.check_page, page, depth) : (page, depth) })
+                    started += 1
+
+                if not in_flight:
+                    break
+
+                done, not_done = concurrent.futures.wait(in_flight,
+                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+
+                    page, depth = in_flight.pop(future)
+                    try:
+                        result, doc = future.result()
+                    except Exception as e:
+                        # report the page as failed instead of dropping it #
+                        print("Check of {} failed: {}".format(page, repr(e)), file=sys.stderr)
+                        results.append((page, { "base_status" : False, "error" : repr(e) }))
+                        continue
+
+                    results.append((page, result))
+
+                    if depth >= self.max_depth or partial:
+                        continue
+
+                    for link in self._links(doc, seed):
+                        if link not in seen:
+                            seen.add(link)
+                            frontier.append((link, depth + 1))
+
+        return (results, partial)
+
+def get_crawler(check_page):
+    '''Crawler configured from env'''
+
+    return Crawler(check_page,
+                max_depth=int(os.environ.get("CRAWL_MAX_DEPTH") or 5),
+                max_pages=int(os.environ.get("CRAWL_MAX_PAGES") or 500),
+                budget=float(os.environ.get("CRAWL_BUDGET") or 600),
+                workers=int(os.environ.get("CRAWL_WORKERS") or 4),
+                use_sitemap=os.environ.get("CRAWL_SITEMAP", "0") not in ("", "0", "false"))
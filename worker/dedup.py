@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import collections
+
+import crawler
+
+def message_key(message):
+    '''Fingerprint of one dispatch of a check: the dispatch id set by the master,
+       the canonical URL and the requested checks, independent of key order, token
+       or dictionary words. Only redeliveries of the same dispatch share a key, so
+       runs of an URL in short intervals are never skipped.'''
+
+    work = { "url" : crawler.canonical_url(message.get("url") or ""),
+             "dispatch_id" : message.get("dispatch_id") }
+    for flag in ("check_spelling", "check_lighthouse", "check_links", "recursive"):
+        work.update({ flag : bool(message.get(flag)) })
+
+    return hashlib.sha256(json.dumps(work, sort_keys=True).encode()).hexdigest()
+
+RUNNING = "running"
+DONE = "done"
+
+def _alive(pid):
+    '''Check if a process of this host is still running'''
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+class Deduplicator:
+    '''Remembers fingerprints of checks being run or recently run.
+
+       A key is claimed before its check runs, with a lease of lease seconds, and
+       marked done after the results were submitted, which keeps it for ttl seconds.
+       A claim fails while the key is done or its check still runs, a check whose
+       process died or whose lease expired is run again, as is a failed one.
+
+       Kept in memory, bounded to max_size entries with the oldest dropped first,
+       or in a SQLite file at path, which several worker processes on one host can
+       share. Entries expire individually, they are not wiped all at once.'''
+
+    def __init__(self, ttl=300, max_size=10000, path=None, lease=1800):
+
+        self.ttl = ttl
+        self.lease = lease
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = None
+        self.entries = collections.OrderedDict()
+        self.inserts = 0
+
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute('''CREATE TABLE IF NOT EXISTS dedup_keys (
+                                    key TEXT PRIMARY KEY,
+                                    state TEXT,
+                                    pid INTEGER,
+                                    expires REAL)''')
+            self.db.execute("CREATE INDEX IF NOT EXISTS ix_dedup_keys_expires ON dedup_keys (expires)")
+            self.db.commit()
+
+    def _live(self, state, pid, expires, now):
+
+        if expires <= now:
+            return False
+
+        return state == DONE or _alive(pid)
+
+    def claim(self, key):
+        '''Claim a key for running its check, False if it is a duplicate'''
+
+        with self.lock:
+
+            if self.db:
+                claimed = self._claim_db(key, time.time())
+            else:
+                claimed = self._claim_memory(key, time.time())
+
+            if claimed:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return claimed
+
+    def _claim_memory(self, key, now):
+
+        # drop expired entries from the front, the oldest ones expire first mostly #
+        while self.entries and next(iter(self.entries.values()))[2] <= now:
+            self.entries.popitem(last=False)
+
+        entry = self.entries.get(key)
+        if entry and self._live(*entry, now):
+            return False
+
+        self.entries.update({ key : (RUNNING, os.getpid(), now + self.lease) })
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        return True
+
+    def _claim_db(self, key, now):
+
+        # read and claim in one transaction, so only one process gets the key #
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT state, pid, expires FROM dedup_keys WHERE key = ?",
+                                    (key,)).fetchone()
+            if row and self._live(*row, now):
+                self.db.rollback()
+                return False
+
+            self.db.execute("INSERT OR REPLACE INTO dedup_keys VALUES (?, ?, ?, ?)",
+                                (key, RUNNING, os.getpid(), now + self.lease))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        self.inserts += 1
+        if self.inserts % 100 == 0:
+            self._purge_db(now)
+
+        return True
+
+    def _purge_db(self, now):
+
+        self.db.execute("DELETE FROM dedup_keys WHERE expires <= ?", (now,))
+        self.db.execute('''DELETE FROM dedup_keys WHERE key IN (
+                                SELECT key FROM dedup_keys ORDER BY expires DESC LIMIT -1 OFFSET ?)''',
+                            (self.max_size,))
+        self.db.commit()
+
+    def done(self, key):
+        '''Mark the check of a claimed key as completed'''
+
+        expires = time.time() + self.ttl
+        with self.lock:
+            if self.db:
+                self.db.execute("UPDATE dedup_keys SET state = ?, expires = ? WHERE key = ?",
+                                    (DONE, expires, key))
+                self.db.commit()
+            elif key in self.entries:
+                self.entries.update({ key : (DONE, os.getpid(), expires) })
+                self.entries.move_to_end(key)
+
+    def forget(self, key):
+        '''Drop a key, so a failed check can be retried'''
+
+        with self.lock:
+            if self.db:
+                self.db.execute("DELETE FROM dedup_keys WHERE key = ?", (key,))
+                self.db.commit()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        return { "hits" : self.hits, "misses" : self.misses }
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+def get_deduplicator():
+    '''Process wide Deduplicator, configured from env, shared via env:DEDUP_DB if set'''
+
+    global _deduplicator
+
+    with _deduplicator_lock:
+        if not _deduplicator:
+            _deduplicator = Deduplicator(ttl=float(os.environ.get("DEDUP_TTL") or 300),
+                                max_size=int(os.environ.get("DEDUP_MAX_SIZE") or 10000),
+                                path=os.environ.get("DEDUP_DB"),
+                                lease=float(os.environ.get("DEDUP_LEASE") or 1800))
+
+    return _deduplicator
@@ -0,0 +1,43 @@
+import bs4
+
+# lxml parses several times faster than the pure python parser #
+try:
+    import lxml
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+class Document:
+    '''A fetched page, parsed once and shared by the spelling, link and crawl stages.
+       Text nodes and hrefs are extracted in a single pass over the tree, the tree
+       itself is not kept.'''
+
+    def __init__(self, url, body, parser=PARSER):
+
+        self.url = url
+        self.texts = []
+        self.hrefs = []
+
+        # failed fetches carry an error message or nothing instead of HTML #
+        if not body or not isinstance(body, (bytes, str)):
+            return
+
+        soup = bs4.BeautifulSoup(body, parser)
+        for tag in soup.find_all():
+
+            if tag.name == "a":
+                href = tag.get("href")
+                if href:
+                    self.hrefs.append(href)
+
+            if isinstance(tag.string, bs4.NavigableString):
+                self.texts.append(tag.get_text())
+
+    @staticmethod
+    def from_hrefs(url, hrefs):
+        '''Document of an unchanged page, rebuilt from its previously extracted hrefs'''
+
+        doc = Document(url, None)
+        doc.hrefs = list(hrefs or [])
+
+        return doc
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+class FingerprintStore:
+    '''Last known state of checked pages: validators for conditional requests, a hash
+       of the body, its links and the spelling/link results computed for it. Kept in a
+       SQLite file so it survives restarts, or in memory if no path is given.'''
+
+    def __init__(self, path=None):
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+
+        if path:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+
+        self.db.execute('''CREATE TABLE IF NOT EXISTS fingerprints (
+                                url TEXT PRIMARY KEY,
+                                etag TEXT,
+                                last_modified TEXT,
+                                body_hash TEXT,
+                                hrefs TEXT,
+                                overlay_key TEXT,
+                                spelling TEXT,
+                                links TEXT,
+                                timestamp REAL)''')
+        self.db.commit()
+
+    def get(self, url):
+        '''Returns the fingerprint of an URL as dict or None'''
+
+        with self.lock:
+            row = self.db.execute("SELECT * FROM fingerprints WHERE url = ?", (url,)).fetchone()
+
+        if not row:
+            return None
+
+        fingerprint = dict(row)
+        for key in ("hrefs", "spelling", "links"):
+            if fingerprint[key] is not None:
+                fingerprint[key] = json.loads(fingerprint[key])
+
+        return fingerprint
+
+    def put(self, url, etag, last_modified, body_hash, hrefs, overlay_key, spelling, links,
+                timestamp=None):
+
+        values = (url, etag, last_modified, body_hash, json.dumps(hrefs), overlay_key,
+                  None if spelling is None else json.dumps(spelling),
+                  None if links is None else json.dumps(links),
+                  timestamp or time.time())
+
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                values)
+            self.db.commit()
+
+def body_hash(body):
+    return hashlib.sha256(body).hexdigest() if body else None
+
+def can_reuse(fingerprint, check_spelling, check_links, overlay_key, max_age):
+    '''Check if a fingerprint holds all requested results and is recent enough'''
+
+    if not fingerprint:
+        return False
+    if time.time() - fingerprint["timestamp"] > max_age:
+        return False
+    if check_spelling and (fingerprint["spelling"] is None or fingerprint["overlay_key"] != overlay_key):
+        return False
+    if check_links and fingerprint["links"] is None:
+        return False
+
+    return True
+
+def conditional_headers(fingerprint):
+    '''Request headers to only get the page if it changed'''
+
+    headers = dict()
+    if fingerprint.get("etag"):
+        headers.update({ "If-None-Match" : fingerprint["etag"] })
+    if fingerprint.get("last_modified"):
+        headers.update({ "If-Modified-Since" : fingerprint["last_modified"] })
+
+    return headers
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    '''Process wide store, persisted at env:FINGERPRINT_DB if set'''
+
+    global _store
+
+    with _store_lock:
+        if not _store:
+            _store = FingerprintStore(os.environ.get("FINGERPRINT_DB"))
+
+    return _store
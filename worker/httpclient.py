@@ -0,0 +1,102 @@
+import os
+import threading
+import http.cookiejar
+import requests
+import requests.adapters
+
+_session = None
+_adapters = []
+_lock = threading.Lock()
+
+def _timeout():
+    return (float(os.environ.get("HTTP_CONNECT_TIMEOUT") or 10),
+            float(os.environ.get("HTTP_READ_TIMEOUT") or 30))
+
+class _Session(requests.Session):
+    '''Session with a default timeout for every request'''
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+def get_session():
+    '''Process wide HTTP session with keep-alive connection pools per host.
+
+       Safe to share between threads: at most env:HTTP_POOL_PER_HOST connections are
+       opened to one host, further requests wait for a free connection instead of
+       opening new ones. Cookies are never stored, so checks don't influence each
+       other. Timeouts default to env:HTTP_CONNECT_TIMEOUT/HTTP_READ_TIMEOUT.'''
+
+    global _session
+
+    with _lock:
+
+        if not _session:
+
+            session = _Session(_timeout())
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+            for prefix in ("http://", "https://"):
+                adapter = requests.adapters.HTTPAdapter(
+                                pool_connections=int(os.environ.get("HTTP_POOL_HOSTS") or 100),
+                                pool_maxsize=int(os.environ.get("HTTP_POOL_PER_HOST") or 10),
+                                pool_block=True)
+                session.mount(prefix, adapter)
+                _adapters.append(adapter)
+
+            _session = session
+
+    return _session
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+def probe(url):
+    '''Get the status code of an URL, the connection is closed after the headers'''
+
+    with get_session().get(url, stream=True) as r:
+        return r.status_code
+
+def fetch(url, max_bytes, headers=None):
+    '''Stream an URL, reading at most max_bytes of the body and only if it is HTML or
+       text, returns (response, body or None)'''
+
+    with get_session().get(url, stream=True, headers=headers) as r:
+
+        content_type = r.headers.get("Content-Type", "text/html").split(";")[0].strip().lower()
+        if content_type not in HTML_CONTENT_TYPES:
+            return (r, None)
+
+        chunks = []
+        size = 0
+        for chunk in r.iter_content(chunk_size=65536):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                print("Body of {} truncated at {} bytes".format(url, max_bytes))
+                break
+
+    return (r, b"".join(chunks)[:max_bytes])
+
+def stats():
+    '''Connection reuse of the currently pooled hosts'''
+
+    hosts = 0
+    connections = 0
+    requests_sent = 0
+
+    for adapter in _adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if not pool:
+                continue
+            hosts += 1
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+
+    return { "hosts" : hosts, "connections" : connections, "requests" : requests_sent,
+             "reused" : requests_sent - connections }
@@ -0,0 +1,257 @@
+import os
+import time
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
+
+class TokenBucket:
+    '''Allow rate requests per second on average, with bursts of up to burst requests'''
+
+    def __init__(self, rate, burst):
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        '''Take a token if one is available, returns 0 or the seconds until there is one'''
+
+        with self.lock:
+
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        '''Block until a request may be made'''
+
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+_checker = None
+_checker_lock = threading.Lock()
+
+class LinkStatusCache:
+    '''Status of already probed links, so every distinct link of a crawl is probed
+       once. Links being probed are tracked as well, concurrent pages sharing a link
+       wait for the running probe. Entries expire after ttl seconds if a ttl is given.'''
+
+    def __init__(self, ttl=None):
+
+        self.ttl = ttl
+        self.entries = dict()
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+
+    def _get(self, url):
+
+        entry = self.entries.get(url)
+        if not entry:
+            return None
+
+        ok, timestamp = entry
+        if self.ttl and time.monotonic() - timestamp > self.ttl:
+            del self.entries[url]
+            return None
+
+        return ok
+
+    def get(self, url):
+        '''Returns the cached status or None'''
+
+        with self.lock:
+            return self._get(url)
+
+    def claim(self, url):
+        '''Returns (future, owner): a future for the status of url, owner being True if
+           the caller has to probe it and resolve the future with put() or release()'''
+
+        with self.lock:
+
+            ok = self._get(url)
+            if ok is not None:
+                future = concurrent.futures.Future()
+                future.set_result(ok)
+                return (future, False)
+
+            if url in self.in_flight:
+                return (self.in_flight[url], False)
+
+            future = concurrent.futures.Future()
+            self.in_flight[url] = future
+            return (future, True)
+
+    def put(self, url, ok):
+
+        with self.lock:
+            self.entries[url] = (ok, time.monotonic())
+            future = self.in_flight.pop(url, None)
+
+        if future and not future.done():
+            future.set_result(ok)
+
+    def release(self, url, exception):
+        '''Give up a claimed url, waiting callers get the exception'''
+
+        with self.lock:
+            future = self.in_flight.pop(url, None)
+
+        if future and not future.done():
+            future.set_exception(exception)
+
+    def purge(self):
+        '''Drop expired entries'''
+
+        if not self.ttl:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            for url in [ u for u, (ok, t) in self.entries.items() if now - t > self.ttl ]:
+                del self.entries[url]
+
+_shared_cache = None
+
+def new_cache():
+    '''Cache for one crawl, or a process wide cache surviving across runs if
+       env:LINK_CACHE_TTL (seconds) is set'''
+
+    global _shared_cache
+
+    ttl = float(os.environ.get("LINK_CACHE_TTL") or 0)
+    if not ttl:
+        return LinkStatusCache()
+
+    with _checker_lock:
+        if not _shared_cache:
+            _shared_cache = LinkStatusCache(ttl)
+        _shared_cache.purge()
+
+    return _shared_cache
+
+class LinkChecker:
+    '''Probe links concurrently with a global cap on parallel requests and a token
+       bucket per hostname, so many hosts are checked at once without hammering any
+       single one of them. Buckets are kept for the lifetime of the checker, which
+       keeps the rate limit across the pages of a crawl and across parallel checks.
+
+       Links wait for their host's bucket in per host queues, which a dispatcher
+       thread hands to the executor as tokens become available, so the executor's
+       threads only ever do requests and a slow host can't occupy all of them.
+
+       Links to the checked site itself use a separate bucket of site_rate and
+       site_burst. The monitored site is already loaded page by page by the crawler
+       without a rate limit, so its links are probed at a higher rate as well
+       instead of holding a page with many internal links for minutes.'''
+
+    def __init__(self, probe, max_workers=32, host_rate=2, host_burst=4,
+                    site_rate=20, site_burst=20):
+
+        self.probe = probe
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.site_rate = site_rate
+        self.site_burst = site_burst
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.buckets = dict()
+        self.pending = dict()
+        self.condition = threading.Condition()
+
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def _bucket(self, key):
+        '''Bucket of a (hostname, is the checked site) key'''
+
+        if key not in self.buckets:
+            hostname, site = key
+            if site:
+                self.buckets[key] = TokenBucket(self.site_rate, self.site_burst)
+            else:
+                self.buckets[key] = TokenBucket(self.host_rate, self.host_burst)
+        return self.buckets[key]
+
+    def _dispatch(self):
+
+        with self.condition:
+            while True:
+
+                wait = None
+                for key in list(self.pending):
+
+                    pending = self.pending[key]
+                    while pending:
+                        delay = self._bucket(key).try_acquire()
+                        if delay:
+                            wait = min(wait or delay, delay)
+                            break
+                        self.executor.submit(self._check, *pending.popleft())
+
+                    if not pending:
+                        del self.pending[key]
+
+                # woken up early by new links #
+                self.condition.wait(timeout=wait)
+
+    def _check(self, url, cache):
+
+        try:
+            ok = self.probe(url)
+        except Exception as e:
+            cache.release(url, e)
+            return
+
+        cache.put(url, ok)
+
+    def check(self, urls, cache=None, site=None):
+        '''Probe all urls which are neither cached nor being probed already, returns a
+           list of (url, result) in the order of urls. Links to the hostname site are
+           limited by the site rate instead of the per host rate.'''
+
+        cache = cache or LinkStatusCache()
+
+        futures = dict()
+        with self.condition:
+            for url in urls:
+
+                if url in futures:
+                    continue
+
+                futures[url], owner = cache.claim(url)
+                if owner:
+                    hostname = urllib.parse.urlparse(url).hostname
+                    key = (hostname, bool(site) and hostname == site)
+                    self.pending.setdefault(key, collections.deque()).append((url, cache))
+
+            self.condition.notify()
+
+        return [ (url, futures[url].result()) for url in urls ]
+
+def get_checker(probe):
+    '''Process wide LinkChecker, configured from env'''
+
+    global _checker
+
+    with _checker_lock:
+        if not _checker:
+            _checker = LinkChecker(probe,
+                            max_workers=int(os.environ.get("LINK_CHECK_WORKERS") or 32),
+                            host_rate=float(os.environ.get("LINK_CHECK_HOST_RATE") or 2),
+                            host_burst=float(os.environ.get("LINK_CHECK_HOST_BURST") or 4),
+                            site_rate=float(os.environ.get("LINK_CHECK_SITE_RATE") or 20),
+                            site_burst=float(os.environ.get("LINK_CHECK_SITE_BURST") or 20))
+
+    return _checker
@@ -1,43 +1,47 @@
 import pika
 import json
-import requests
 import argparse
 import checks
+import httpclient
+import dedup
 import json
 import sys
-import datetime
 import os
 import time
+import functools
+import concurrent.futures
 
 MASTER_HOST = None
 FILE_OVERWRITE = None
 
-recent_events = {}
-purge_cycle_next = None
+def run_check(body):
+    '''Run the checks of a queue message and submit the results, raises if the
+       submission failed'''
 
-def _is_recent_duplicate(body):
+    print(body)
+    d = json.loads(body)
 
-    global purge_cycle_next
-    global recent_events
+    if d.get("force_run"):
+        _run_and_submit(d)
+        return
 
-    if not purge_cycle_next or purge_cycle_next < datetime.datetime.now():
-        purge_cycle_next = datetime.datetime.now() + datetime.timedelta(minutes=5)
-        recent_events = {}
+    # skip checks which recently ran, here or in another worker sharing env:DEDUP_DB #
+    deduplicator = dedup.get_deduplicator()
+    key = dedup.message_key(d)
+    if not deduplicator.claim(key):
+        print("Skipping.. (duplicate) {}".format(deduplicator.stats()))
+        return
 
-    if hash(body) in recent_events:
-        return True
-    else:
-        recent_events.update({ hash(body) : datetime.datetime.now() })
-        return False
+    try:
+        _run_and_submit(d)
+    except Exception:
+        # allow the redelivered message to run again #
+        deduplicator.forget(key)
+        raise
 
-def callback(ch, method, properties, body):
+    deduplicator.done(key)
 
-    print(body)
-    d = json.loads(body)
-
-    if not d.get("force_run") and _is_recent_duplicate(body):
-        print("Skipping.. (duplicate)")
-        return
+def _run_and_submit(d):
 
     url = d.get("url")
     recursive = d.get("recursive")
@@ -51,10 +55,10 @@ def callback(ch, method, properties, body):
 
     if recursive:
         results = checks.check_url_recursive(url, check_lighthouse, check_links,
-                                                check_spelling, extra_words)
+                                                check_spelling, extra_words, full_ignore)
     else:
-        r, body = checks.check_url(url, check_lighthouse, check_links,
-                                    check_spelling, extra_words, full_ignore)
+        r, doc = checks.check_url(url, check_lighthouse, check_links, check_spelling,
+                                    extra_words=extra_words, full_ignore=full_ignore)
         results = { "check" : [(url,r)] }
 
     # submitt results back to master #
@@ -62,8 +66,60 @@ def callback(ch, method, properties, body):
     results.update({ "url" : url })
 
     print(json.dumps(results, indent=2))
-    r = requests.post("{}{}".format(MASTER_HOST, "/submit-check"), json=results)
+    r = httpclient.get_session().post("{}{}".format(MASTER_HOST, "/submit-check"), json=results)
     print(r.status_code, r.content)
+    print("HTTP connections: {}".format(httpclient.stats()))
+    r.raise_for_status()
+
+def _on_check_done(connection, channel, method, future):
+    '''Ack or reject a message from the thread that ran its check'''
+
+    if future.exception():
+        # retry once on another worker, drop messages which failed before #
+        print("Check failed: {}".format(repr(future.exception())), file=sys.stderr)
+        settle = functools.partial(channel.basic_nack, method.delivery_tag,
+                                    requeue=not method.redelivered)
+    else:
+        settle = functools.partial(channel.basic_ack, method.delivery_tag)
+
+    # pika is not thread safe, ack from the connection's thread #
+    try:
+        connection.add_callback_threadsafe(settle)
+    except pika.exceptions.AMQPError as e:
+        print("Cannot settle message, it will be redelivered: {}".format(repr(e)), file=sys.stderr)
+
+def queue_for_group(base_name, group):
+    '''Queue of an URL group listed in the master's env:QUEUE_GROUPS, the base queue
+       for an empty group, which all other groups are published to (same mapping as
+       publisher.queue_for_group on the master)'''
+
+    group = (group or "").strip()
+    if not group:
+        return base_name
+
+    return "{}.{}".format(base_name, group)
+
+def consume(queue_host, queue_names, parallelism, executor):
+    '''Consume messages with up to parallelism checks in flight, the connection thread
+       only dispatches and acks, so heartbeats are served while checks run'''
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(queue_host))
+    print("Connected successfully to {}".format(queue_host))
+    channel = connection.channel()
+
+    # the prefetch limit is shared by the consumers of all queues #
+    channel.basic_qos(prefetch_count=parallelism, global_qos=True)
+
+    def on_message(channel, method, properties, body):
+        future = executor.submit(run_check, body)
+        future.add_done_callback(functools.partial(_on_check_done, connection, channel, method))
+
+    for queue_name in queue_names:
+        channel.queue_declare(queue=queue_name)
+        channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=False)
+        print("Consuming {}".format(queue_name))
+
+    channel.start_consuming()
 
 
 if __name__ == "__main__":
@@ -73,8 +129,10 @@ if __name__ == "__main__":
 
     parser.add_argument("-H", "--master-host", default="main", help="Master Server to submit results to")
     parser.add_argument("-q", "--queue-host", default="queue", help="Queue host to subscribe to")
-    parser.add_argument("-n", "--queue-name", default="scheduled", help="Queue to consume")
+    parser.add_argument("-n", "--queue-name", default="scheduled", help="Base name of the queues to consume")
+    parser.add_argument("-g", "--groups", default="", help="Comma separated URL groups to consume (see master env:QUEUE_GROUPS), empty for the base queue")
     parser.add_argument("-f", "--file-overwrite", help="Read and write to file instead")
+    parser.add_argument("-p", "--parallelism", type=int, default=1, help="Checks to run in parallel")
 
     args = parser.parse_args()
 
@@ -91,25 +149,32 @@ if __name__ == "__main__":
     if os.environ.get("QUEUE_NAME"):
         queue_name = os.environ.get("QUEUE_NAME")
 
+    groups = args.groups
+    if os.environ.get("WORKER_GROUPS") is not None:
+        groups = os.environ.get("WORKER_GROUPS")
+
+    queue_names = list(dict.fromkeys(queue_for_group(queue_name, g) for g in groups.split(",")))
+
+    parallelism = args.parallelism
+    if os.environ.get("WORKER_PARALLELISM"):
+        parallelism = int(os.environ.get("WORKER_PARALLELISM"))
+
     if not MASTER_HOST.startswith(("https://", "http://")):
         MASTER_HOST = "http://" + MASTER_HOST
 
 
     if FILE_OVERWRITE:
         with open(FILE_OVERWRITE) as f:
-            callback(None, None, None, f.read())
+            run_check(f.read())
         sys.exit(0)
 
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallelism)
+
     # Establish connection to RabbitMQ server
     for i in range(0,5):
 
         try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(queue_host))
-            print("Connected successfully to {}".format(queue_host))
-            channel = connection.channel()
-            channel.queue_declare(queue=queue_name)
-            channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-            channel.start_consuming()
+            consume(queue_host, queue_names, parallelism, executor)
         except pika.exceptions.AMQPConnectionError as e:
             print(type(e), file=sys.stderr)
 
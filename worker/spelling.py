@@ -0,0 +1,220 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import hashlib
+import threading
+import collections
+import pkg_resources
+import symspellpy
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+OVERLAY_CACHE_SIZE = 64
+
+# bump if the dictionary or the verdict logic changes, invalidates cached verdicts #
+DICTIONARY_VERSION = "en_82_765+bigram_243_342:{}:1".format(getattr(symspellpy, "__version__", ""))
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+_overlays = collections.OrderedDict()
+_overlays_lock = threading.Lock()
+
+def _new_symspell():
+    return symspellpy.SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE,
+                                prefix_length=PREFIX_LENGTH)
+
+def build_dictionary():
+    '''Build the base dictionary from the word lists shipped with symspellpy'''
+
+    sym_spell = _new_symspell()
+    dictionary_path = pkg_resources.resource_filename("symspellpy", "frequency_dictionary_en_82_765.txt")
+    bigram_path = pkg_resources.resource_filename("symspellpy", "frequency_bigramdictionary_en_243_342.txt")
+
+    sym_spell.load_dictionary(dictionary_path, term_index=0, count_index=1)
+    sym_spell.load_bigram_dictionary(bigram_path, term_index=0, count_index=2)
+
+    return sym_spell
+
+def get_dictionary():
+    '''Process wide base dictionary, loaded once from the precompiled pickle at
+       env:SYMSPELL_PICKLE if it exists or built from the word lists otherwise.
+       It is shared between threads and must not be modified.'''
+
+    global _dictionary
+
+    with _dictionary_lock:
+
+        if not _dictionary:
+
+            pickle_path = os.environ.get("SYMSPELL_PICKLE")
+            if pickle_path and os.path.isfile(pickle_path):
+                sym_spell = _new_symspell()
+                sym_spell.load_pickle(pickle_path)
+            else:
+                sym_spell = build_dictionary()
+
+            _dictionary = sym_spell
+
+    return _dictionary
+
+def _as_list(words):
+    '''Word lists may be sent as lists or comma/whitespace separated strings'''
+
+    if not words:
+        return []
+    if isinstance(words, str):
+        return [ w for w in re.split(r'[\s,]+', words) if w ]
+
+    return list(words)
+
+class Overlay:
+    '''Owner specific additions to the base dictionary. Extra words are accepted as
+       correctly spelled, full ignore entries (words or patterns) are skipped. Both
+       are removed from a text before it is looked up in the base dictionary.'''
+
+    def __init__(self, extra_words, full_ignore):
+
+        patterns = []
+        for word in extra_words:
+            patterns.append(r'\b{}\b'.format(re.escape(word)))
+        for pattern in full_ignore:
+            try:
+                re.compile(pattern)
+                patterns.append(pattern)
+            except re.error:
+                patterns.append(re.escape(pattern))
+
+        self.regex = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+
+    def strip(self, text):
+        '''Remove accepted and ignored words from a text'''
+
+        if not self.regex:
+            return text
+
+        return self.regex.sub(" ", text)
+
+def overlay_key(extra_words, full_ignore):
+    '''Hash identifying a set of extra and ignored words'''
+
+    digest = hashlib.sha256()
+    for word in sorted(_as_list(extra_words)):
+        digest.update(b"e:" + word.encode() + b"\0")
+    for word in sorted(_as_list(full_ignore)):
+        digest.update(b"i:" + word.encode() + b"\0")
+
+    return digest.hexdigest()
+
+def get_overlay(extra_words, full_ignore):
+    '''Cached overlay for a set of extra and ignored words, returns (key, overlay)'''
+
+    key = overlay_key(extra_words, full_ignore)
+
+    with _overlays_lock:
+
+        if key in _overlays:
+            _overlays.move_to_end(key)
+            return (key, _overlays[key])
+
+        overlay = Overlay(_as_list(extra_words), _as_list(full_ignore))
+        _overlays[key] = overlay
+        if len(_overlays) > OVERLAY_CACHE_SIZE:
+            _overlays.popitem(last=False)
+
+    return (key, overlay)
+
+def fragment_key(overlay_key, fragment):
+    '''Cache key of a text fragment checked with a dictionary overlay'''
+
+    digest = hashlib.sha256()
+    digest.update(DICTIONARY_VERSION.encode() + b"\0")
+    digest.update(overlay_key.encode() + b"\0")
+    digest.update(fragment.encode())
+
+    return digest.hexdigest()
+
+class FragmentCache:
+    '''Bounded LRU of fragment key -> spelling verdict (a suggestion or None), with an
+       optional SQLite file as persistent second tier shared across runs'''
+
+    def __init__(self, max_size, path=None):
+
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.execute("CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, verdict TEXT)")
+            self.db.commit()
+
+    def get(self, key):
+        '''Returns (found, verdict)'''
+
+        with self.lock:
+
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return (True, self.entries[key])
+
+            if self.db:
+                row = self.db.execute("SELECT verdict FROM fragments WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._remember(key, json.loads(row[0]))
+                    self.hits += 1
+                    return (True, self.entries[key])
+
+            self.misses += 1
+            return (False, None)
+
+    def put(self, key, verdict):
+
+        with self.lock:
+
+            self._remember(key, verdict)
+
+            if self.db:
+                self.db.execute("INSERT OR REPLACE INTO fragments VALUES (?, ?)",
+                                    (key, json.dumps(verdict)))
+                self.db.commit()
+
+    def _remember(self, key, verdict):
+
+        self.entries[key] = verdict
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+_fragment_cache = None
+
+def get_fragment_cache():
+    '''Process wide fragment cache, sized by env:SPELLING_CACHE_SIZE and persisted to
+       env:SPELLING_CACHE_FILE if set'''
+
+    global _fragment_cache
+
+    with _dictionary_lock:
+        if not _fragment_cache:
+            _fragment_cache = FragmentCache(int(os.environ.get("SPELLING_CACHE_SIZE") or 100000),
+                                            os.environ.get("SPELLING_CACHE_FILE"))
+
+    return _fragment_cache
+
+if __name__ == "__main__":
+
+    # precompile the dictionary, done once when the worker image is built #
+    if len(sys.argv) != 2:
+        print("Usage: {} PICKLE_PATH".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    build_dictionary().save_pickle(sys.argv[1])